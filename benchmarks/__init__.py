@@ -0,0 +1,29 @@
+from typing import Callable, Dict, Sequence
+import numpy as np
+import time
+
+# scripts measuring the query path against locally running services, see the bench-* recipes
+
+def percentiles(latencies: Sequence[float]) -> Dict[str, float]:
+    # milliseconds
+    values = np.asarray(latencies) * 1000
+    return {
+        "p50": float(np.percentile(values, 50)),
+        "p99": float(np.percentile(values, 99)),
+        "mean": float(values.mean()),
+    }
+
+def timed(function: Callable[[], object], rounds: int) -> list[float]:
+    latencies = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def print_row(name: str, latencies: Sequence[float]) -> None:
+    stats = percentiles(latencies)
+    print(f"{name:<28}{stats['p50']:>10.2f}{stats['p99']:>10.2f}{stats['mean']:>10.2f}")
+
+def print_header(name: str = "operation") -> None:
+    print(f"{name:<28}{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}")
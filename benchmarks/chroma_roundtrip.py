@@ -0,0 +1,57 @@
+from chromadb.api.types import IncludeEnum
+from database.chroma import close_client, get_client
+from database.enums import ChromaCollection
+from benchmarks import print_header, print_row, timed
+import numpy as np
+import itertools
+import sys
+
+# round trip latency of the chroma client against the local server, with random query vectors
+# so that the model is never loaded: heartbeat, uncached and cached single queries and one
+# query_many request for a batch of queries. Usage: python -m benchmarks.chroma_roundtrip [collection] [rounds]
+
+def benchmark_chroma(collection: ChromaCollection, rounds: int = 200, batch_size: int = 16) -> None:
+    client = get_client()
+    if client is None:
+        raise ValueError("Chroma is disabled (QUERY_ONLY_LOCAL=1)")
+
+    sample = client.get_collection(collection).get(limit=1, include=[IncludeEnum.embeddings])
+    if len(sample["embeddings"]) == 0:
+        raise ValueError(f"Collection {collection.value} is empty")
+    dimension = len(sample["embeddings"][0])
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((rounds * batch_size, dimension)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    # every query text is new, so the result cache never answers the uncached rows
+    counter = itertools.count()
+
+    def uncached() -> None:
+        i = next(counter)
+        client.query_many(collection, [f"bench {i}"], query_embeddings=vectors[i % len(vectors)][None])
+
+    def cached() -> None:
+        client.query_many(collection, ["bench cached"], query_embeddings=vectors[:1])
+
+    def batch() -> None:
+        start = next(counter) * batch_size % len(vectors)
+        queries = [f"bench batch {start + i}" for i in range(batch_size)]
+        client.query_many(collection, queries, query_embeddings=vectors[start:start + batch_size])
+
+    print(f"{collection.value}: {client.get_collection(collection).count()} documents, dimension {dimension}, {rounds} rounds")
+    print_header()
+    print_row("heartbeat", timed(client.heartbeat, rounds))
+    print_row("query", timed(uncached, rounds))
+    print_row("query (result cache)", timed(cached, rounds))
+    latencies = timed(batch, max(rounds // batch_size, 10))
+    print_row(f"query_many x{batch_size}", latencies)
+    print_row(f"query_many x{batch_size} per query", [latency / batch_size for latency in latencies])
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    collection = ChromaCollection(args[0]) if args else ChromaCollection.Faculty
+    rounds = int(args[1]) if len(args) > 1 else 200
+    try:
+        benchmark_chroma(collection, rounds)
+    finally:
+        close_client()
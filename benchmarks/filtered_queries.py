@@ -0,0 +1,74 @@
+from chromadb.api.types import IncludeEnum
+from database.chroma import build_where, close_client, get_client
+from database.enums import ChromaCollection
+from benchmarks import print_header, print_row
+from collections import Counter
+import numpy as np
+import time
+import sys
+
+# metadata filtered queries (the where clause QueryFilters compiles through build_where) against
+# fetching n_results * factor unfiltered neighbours and filtering them in python, on the most
+# common value of a metadata field. recall is the share of the filtered top k the over-fetch finds.
+# Usage: python -m benchmarks.filtered_queries [collection] [field] [rounds] [n_results]
+
+OVERFETCH_FACTORS = (2, 4, 10)
+
+def benchmark_filtered_queries(collection: ChromaCollection, 
+                               field: str = "faculty", 
+                               rounds: int = 100, 
+                               n_results: int = 10) -> None:
+    client = get_client()
+    if client is None:
+        raise ValueError("Chroma is disabled (QUERY_ONLY_LOCAL=1)")
+
+    chroma_collection = client.get_collection(collection)
+    metadatas = chroma_collection.get(include=[IncludeEnum.metadatas])["metadatas"] or []
+    values = Counter(metadata[field] for metadata in metadatas if field in metadata)
+    if not values:
+        raise ValueError(f"No document of {collection.value} has a {field} field")
+    value, matching = values.most_common(1)[0]
+    where = build_where(**{field: value})
+
+    rng = np.random.default_rng(0)
+    dimension = len(chroma_collection.get(limit=1, include=[IncludeEnum.embeddings])["embeddings"][0])
+    vectors = rng.standard_normal((rounds, dimension)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    def search(i: int, n: int, filtered: bool) -> list[list[str]]:
+        # a new query text every time so that the result cache never answers
+        result = client.query_many(collection, [f"bench {time.perf_counter_ns()}"], n_results=n,
+                                   query_embeddings=vectors[i:i + 1], where=where if filtered else None)
+        ids, metadatas = result["ids"][0], result["metadatas"][0] # type: ignore
+        return [id for id, metadata in zip(ids, metadatas) if metadata.get(field) == value][:n_results]
+
+    print(f"{collection.value}: {len(metadatas)} documents, {field}={value!r} matches {matching}, "
+          f"{rounds} rounds, top {n_results}")
+    print_header("strategy")
+    latencies, expected = [], []
+    for i in range(rounds):
+        start = time.perf_counter()
+        expected.append(search(i, n_results, filtered=True))
+        latencies.append(time.perf_counter() - start)
+    print_row("where filter", latencies)
+
+    for factor in OVERFETCH_FACTORS:
+        latencies, found = [], 0
+        for i in range(rounds):
+            start = time.perf_counter()
+            ids = search(i, n_results * factor, filtered=False)
+            latencies.append(time.perf_counter() - start)
+            found += len(set(ids) & set(expected[i]))
+        recall = found / max(sum(len(ids) for ids in expected), 1)
+        print_row(f"over-fetch x{factor} (recall {recall:.2f})", latencies)
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    collection = ChromaCollection(args[0]) if args else ChromaCollection.Faculty
+    field = args[1] if len(args) > 1 else "faculty"
+    rounds = int(args[2]) if len(args) > 2 else 100
+    n_results = int(args[3]) if len(args) > 3 else 10
+    try:
+        benchmark_filtered_queries(collection, field, rounds, n_results)
+    finally:
+        close_client()
@@ -0,0 +1,67 @@
+from benchmarks import percentiles
+from collections import Counter
+import asyncio
+import httpx
+import time
+import sys
+import os
+import dotenv
+
+dotenv.load_dotenv()
+
+# load test of a running query API: `clients` concurrent clients each send `requests`
+# GET /api/query/ requests back to back. Every query text is unique, so neither the embedding
+# nor the result cache answers them.
+# Usage: python -m benchmarks.query_load [clients] [requests per client] [collection]
+
+WORDS = ["machine", "learning", "algebra", "history", "organic", "chemistry", "ethics", "finance",
+         "statistics", "robotics", "music", "theory", "biology", "networks", "law", "design"]
+
+async def run_client(client: httpx.AsyncClient, 
+                     index: int, 
+                     requests: int, 
+                     collection: str, 
+                     latencies: list[float], 
+                     statuses: Counter) -> None:
+    for i in range(requests):
+        words = [WORDS[(index * 7 + i * 3 + j) % len(WORDS)] for j in range(3)]
+        params = {"query": f"{' '.join(words)} {index}-{i}", "n_results": 10, "collection": collection}
+        start = time.perf_counter()
+        try:
+            response = await client.get("/api/query/", params=params)
+            statuses[response.status_code] += 1
+        except httpx.HTTPError as e:
+            statuses[type(e).__name__] += 1
+            continue
+        if response.status_code == 200:
+            latencies.append(time.perf_counter() - start)
+
+async def load_test(base_url: str, clients: int, requests: int, collection: str) -> None:
+    latencies: list[float] = []
+    statuses: Counter = Counter()
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        # one request first so that the measured ones don't include connecting and warmup
+        (await client.get("/api/query/", params={"query": "warmup", "collection": collection})).raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            run_client(client, index, requests, collection, latencies, statuses) for index in range(clients)
+        ))
+        elapsed = time.perf_counter() - start
+
+    print(f"{clients} clients x {requests} requests against {base_url} in {elapsed:.1f}s")
+    print("responses: " + ", ".join(f"{status}: {count}" for status, count in sorted(statuses.items(), key=str)))
+    if latencies:
+        stats = percentiles(latencies)
+        print(f"{len(latencies) / elapsed:.1f} req/s, p50 {stats['p50']:.1f} ms, p99 {stats['p99']:.1f} ms, "
+              f"mean {stats['mean']:.1f} ms")
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    clients = int(args[0]) if args else 16
+    requests = int(args[1]) if len(args) > 1 else 20
+    collection = args[2] if len(args) > 2 else "faculty"
+    host = os.getenv("QUERY_API_HOST", "localhost")
+    port = os.getenv("QUERY_API_PORT", "8080")
+    asyncio.run(load_test(f"http://{host}:{port}", clients, requests, collection))
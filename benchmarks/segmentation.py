@@ -0,0 +1,29 @@
+from ecalendar.parsers import make_soup, PARSER_BACKENDS, FACULTY_STRAINER
+from ecalendar.spiders.faculty import CSFacultySpider
+from tests.segmentation import large_page, reference_fetch_content
+from benchmarks import print_header, print_row, timed
+from pathlib import Path
+import sys
+
+# time of the faculty panel segmentation (fetch_content on an already parsed page) against the
+# reference implementation it replaced, on saved pages or on a generated page with many sections.
+# Usage: python -m benchmarks.segmentation [backend] [page.html]...
+
+def benchmark_segmentation(texts: list[str], backend: str = "html.parser", rounds: int = 5) -> None:
+    spider = CSFacultySpider()
+    soups = [make_soup(text, backend, FACULTY_STRAINER) for text in texts]
+
+    print(f"{len(texts)} pages, {sum(len(text) for text in texts) / 1e6:.2f} MB, {backend}, {rounds} rounds")
+    print_header("segmenter")
+    print_row("segment_panel", timed(lambda: [spider.fetch_content(soup, "") for soup in soups], rounds))
+    print_row("reference", timed(lambda: [reference_fetch_content(soup) for soup in soups], rounds))
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    backend = args[0] if args else "html.parser"
+    if backend not in PARSER_BACKENDS:
+        print(f"Usage: python -m benchmarks.segmentation [{'|'.join(PARSER_BACKENDS)}] [page.html]...")
+        sys.exit(1)
+
+    pages = [Path(page).read_text(encoding="utf-8", errors="replace") for page in args[1:]]
+    benchmark_segmentation(pages or [large_page()], backend)
@@ -0,0 +1,38 @@
+from fastapi.responses import JSONResponse
+from fastapi import Response
+from queryAPI import BINARY_MEDIA_TYPE, ENCODE_DTYPES, NPY_MEDIA_TYPE, serialize_vectors
+from benchmarks import percentiles, timed
+import numpy as np
+import sys
+
+# time to serialize an /api/encode/ response and its size on the wire for every format and dtype,
+# json bodies are rendered the way fastapi renders a returned list.
+# Usage: python -m benchmarks.serialization [n_vectors] [dimension] [rounds]
+
+FORMATS = {
+    "json": "application/json",
+    "binary": BINARY_MEDIA_TYPE,
+    "npy": NPY_MEDIA_TYPE,
+}
+
+def render(vectors: np.ndarray, accept: str, dtype: str) -> bytes:
+    response = serialize_vectors(vectors, accept, dtype)
+    return response.body if isinstance(response, Response) else JSONResponse(response).body
+
+def benchmark_serialization(n_vectors: int = 64, dimension: int = 1024, rounds: int = 50) -> None:
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((n_vectors, dimension)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    print(f"{n_vectors} vectors of dimension {dimension}, {rounds} rounds")
+    print(f"{'format':<16}{'p50 ms':>10}{'p99 ms':>10}{'KB':>10}{'bytes/dim':>12}")
+    for name, accept in FORMATS.items():
+        for dtype in ENCODE_DTYPES:
+            size = len(render(vectors, accept, dtype))
+            stats = percentiles(timed(lambda: render(vectors, accept, dtype), rounds))
+            print(f"{name + ' ' + dtype:<16}{stats['p50']:>10.2f}{stats['p99']:>10.2f}"
+                  f"{size / 1024:>10.1f}{size / vectors.size:>12.2f}")
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    benchmark_serialization(*args)
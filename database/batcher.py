@@ -0,0 +1,103 @@
+from concurrent.futures import Executor
+from typing import Callable, Dict, List, Set, Tuple
+import numpy as np
+import asyncio
+
+# coalesces concurrent encode requests into one batched forward pass. a batch is
+# dispatched once it holds max_batch_size texts, or once its oldest request waited
+# max_wait_ms and one of the executor's `workers` is free. while every worker is busy
+# requests keep collecting and are dispatched as soon as a batch finishes
+class EncodeBatcher:
+
+    def __init__(self, 
+                 encode: Callable[[List[str]], np.ndarray], 
+                 executor: Executor,
+                 max_wait_ms: float = 5,
+                 max_batch_size: int = 64,
+                 workers: int = 1) -> None:
+        self.encode_batch = encode
+        self.executor = executor
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.workers = workers
+
+        self.pending: List[Tuple[List[str], asyncio.Future[np.ndarray]]] = []
+        self.pending_texts = 0
+        self.timer: asyncio.TimerHandle | None = None
+        # the event loop only keeps weak references to tasks
+        self.tasks: Set[asyncio.Task[None]] = set()
+
+        self.batches = 0
+        self.requests = 0
+        self.texts = 0
+        self.largest_batch = 0
+
+    async def encode(self, texts: List[str]) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future[np.ndarray] = loop.create_future()
+        self.pending.append((texts, future))
+        self.pending_texts += len(texts)
+
+        if self.pending_texts >= self.max_batch_size:
+            self.dispatch()
+        elif self.timer is None and len(self.tasks) < self.workers:
+            self.timer = loop.call_later(self.max_wait, self.flush)
+
+        return await future
+
+    def flush(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        # a busy worker picks the pending requests up when its batch finishes
+        if len(self.tasks) < self.workers:
+            self.dispatch()
+
+    def dispatch(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.pending:
+            return
+
+        batch, self.pending, self.pending_texts = self.pending, [], 0
+        task = asyncio.get_running_loop().create_task(self.run(batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.finished)
+
+    def finished(self, task: asyncio.Task[None]) -> None:
+        self.tasks.discard(task)
+        # whatever queued up while the workers were busy has waited long enough
+        if len(self.tasks) < self.workers:
+            self.dispatch()
+
+    async def run(self, batch: List[Tuple[List[str], asyncio.Future[np.ndarray]]]) -> None:
+        texts = [text for request_texts, _ in batch for text in request_texts]
+        self.batches += 1
+        self.requests += len(batch)
+        self.texts += len(texts)
+        self.largest_batch = max(self.largest_batch, len(texts))
+
+        try:
+            vectors = await asyncio.get_running_loop().run_in_executor(self.executor, self.encode_batch, texts)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        # hand each caller back its own slice of the batch
+        start = 0
+        for request_texts, future in batch:
+            if not future.done():
+                future.set_result(vectors[start:start + len(request_texts)])
+            start += len(request_texts)
+
+    def stats(self) -> Dict[str, int | float]:
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "texts": self.texts,
+            "mean_batch_size": self.texts / self.batches if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+        }
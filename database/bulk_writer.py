@@ -0,0 +1,124 @@
+from pymongo.collection import Collection
+from pymongo.errors import AutoReconnect, BulkWriteError
+from pymongo.operations import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+from typing import Dict, List, Union
+import threading
+import time
+
+WriteOperation = Union[InsertOne, UpdateOne, UpdateMany, ReplaceOne, DeleteOne, DeleteMany]
+
+# write errors worth retrying: network failures, elections, shutdowns and write conflicts.
+# anything else (11000 duplicate key, 121 document validation...) fails the same way again
+TRANSIENT_ERROR_CODES = frozenset({
+    6,      # HostUnreachable
+    7,      # HostNotFound
+    89,     # NetworkTimeout
+    91,     # ShutdownInProgress
+    112,    # WriteConflict
+    189,    # PrimarySteppedDown
+    262,    # ExceededTimeLimit
+    9001,   # SocketException
+    10107,  # NotWritablePrimary
+    11600,  # InterruptedAtShutdown
+    11602,  # InterruptedDueToReplStateChange
+    13435,  # NotPrimaryNoSecondaryOk
+    13436,  # NotPrimaryOrSecondary
+})
+
+# accumulates write operations for one collection and writes them with unordered
+# bulk_write calls, retrying only the sub-operations that failed with a transient error
+class BulkWriteBuffer:
+
+    def __init__(self, 
+                 collection: Collection, 
+                 max_operations: int = 500, 
+                 max_seconds: float = 2.0,
+                 max_retries: int = 3) -> None:
+        self.collection = collection
+        self.max_operations = max_operations
+        self.max_seconds = max_seconds
+        self.max_retries = max_retries
+
+        self.operations: List[WriteOperation] = []
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+
+        self.flushes = 0
+        self.written = 0
+        self.retried = 0
+        self.failed = 0
+        self.flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+    def add(self, operation: WriteOperation) -> bool:
+        # returns True once the buffer should be flushed
+        with self.lock:
+            self.operations.append(operation)
+            return len(self.operations) >= self.max_operations or self.is_due()
+
+    def is_due(self) -> bool:
+        return bool(self.operations) and time.monotonic() - self.last_flush >= self.max_seconds
+
+    def take(self) -> List[WriteOperation]:
+        with self.lock:
+            operations, self.operations = self.operations, []
+            self.last_flush = time.monotonic()
+            return operations
+
+    def flush(self) -> None:
+        self.write(self.take())
+
+    def write(self, operations: List[WriteOperation]) -> int:
+        # returns the number of operations that failed
+        if not operations:
+            return 0
+
+        started = time.perf_counter()
+        written = retried = failed = 0
+        try:
+            for attempt in range(self.max_retries + 1):
+                if attempt:
+                    time.sleep(0.5 * 2 ** (attempt - 1))
+                    retried += len(operations)
+                try:
+                    self.collection.bulk_write(operations, ordered=False)
+                    written += len(operations)
+                    operations = []
+                    break
+                except BulkWriteError as e:
+                    # the rest of an unordered batch was applied, keep only what failed transiently
+                    errors = {error["index"]: error.get("code") for error in e.details.get("writeErrors", [])}
+                    transient = sorted(index for index, code in errors.items() if code in TRANSIENT_ERROR_CODES)
+                    written += len(operations) - len(errors)
+                    failed += len(errors) - len(transient)
+                    operations = [operations[i] for i in transient]
+                    if not operations:
+                        break
+                except AutoReconnect:
+                    continue
+        except Exception:
+            # any other error (OperationFailure, ...) is raised to the caller, what was still
+            # pending is counted as failed first so the stats match what reached mongo
+            failed += len(operations)
+            operations = []
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.flushes += 1
+                self.written += written
+                self.retried += retried
+                self.failed += failed + len(operations)
+                self.flush_seconds += elapsed
+                self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+        return failed + len(operations)
+
+    def stats(self) -> Dict[str, int | float]:
+        return {
+            "flushes": self.flushes,
+            "written": self.written,
+            "retried": self.retried,
+            "failed": self.failed,
+            "mean_flush_seconds": self.flush_seconds / self.flushes if self.flushes else 0.0,
+            "max_flush_seconds": self.max_flush_seconds,
+        }
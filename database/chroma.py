@@ -1,111 +1,340 @@
 from chromadb import EmbeddingFunction, Embeddings, HttpClient, Collection
-from chromadb.api.types import Embeddable, QueryResult, IncludeEnum, OneOrMany, ID
-from pipelines.embedding_encoder import encode_text
-from typing import List, Mapping
+from chromadb.api.types import Embeddable, QueryResult, IncludeEnum, OneOrMany, ID, Where, WhereDocument
+from chromadb.errors import InvalidCollectionException, NotFoundError
+from database.embbedings import encode_text, encode_batched
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Mapping, Sequence, Tuple, TypeVar, cast
 from database.enums import ChromaCollection
+from database.query_cache import LRUCache, TTLCache
 from tqdm import tqdm
+import numpy as np
+import httpx
+import json
+import threading
+import time
 import os
 import dotenv
 
 dotenv.load_dotenv()
 
+T = TypeVar("T")
+
+# seconds between background heartbeats
+CHROMA_HEALTH_CHECK_INTERVAL = float(os.getenv("CHROMA_HEALTH_CHECK_INTERVAL", "30"))
+
+# first batch size of an ingestion, and the upload latency adaptive batching aims for
+CHROMA_INITIAL_BATCH_SIZE = int(os.getenv("CHROMA_INITIAL_BATCH_SIZE", "64"))
+CHROMA_TARGET_BATCH_SECONDS = float(os.getenv("CHROMA_TARGET_BATCH_SECONDS", "2"))
+
+# bounds of the query text -> embedding cache and of the query -> result cache
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "10000"))
+QUERY_RESULT_CACHE_SIZE = int(os.getenv("QUERY_RESULT_CACHE_SIZE", "5000"))
+QUERY_RESULT_CACHE_TTL = float(os.getenv("QUERY_RESULT_CACHE_TTL", "300"))
+
+# (collection, query, n_results, serialized where / where_document filters)
+ResultKey = Tuple[str, str, int, str]
+
+# errors after which the connection or the cached collection handles can no longer be trusted
+RECONNECT_ERRORS = (httpx.TransportError, InvalidCollectionException, NotFoundError)
+
 class BGEEmbeddingFunction(EmbeddingFunction[Embeddable]):
     def __call__(self, text: List[str]) -> Embeddings: # type: ignore
         return encode_text(text).tolist()
 
 class ChromaClient:
-    def __init__(self) -> None:
-        self.client = HttpClient(host='localhost', port=8000)
-        self.client.heartbeat()
+    def __init__(self, health_check_interval: float = CHROMA_HEALTH_CHECK_INTERVAL) -> None:
+        self.collections: Dict[ChromaCollection, Collection] = {}
+        self.embedding_cache: LRUCache[str, np.ndarray] = LRUCache(QUERY_EMBEDDING_CACHE_SIZE)
+        self.result_cache: TTLCache[ResultKey, QueryResult] = TTLCache(QUERY_RESULT_CACHE_SIZE, QUERY_RESULT_CACHE_TTL)
+        # bumped by every invalidation, a query only caches its result if no write finished meanwhile
+        self.generations: Dict[ChromaCollection, int] = {}
+        self.generation_lock = threading.Lock()
+        self.lock = threading.RLock()
+        self.connect()
+
+        # check the connection in the background instead of before every call
+        self.health_check_interval = health_check_interval
+        self.closed = threading.Event()
+        self.health_thread = threading.Thread(target=self.check_health, daemon=True)
+        self.health_thread.start()
+
+    def connect(self) -> None:
+        with self.lock:
+            self.client = HttpClient(host='localhost', port=8000)
+            self.client.heartbeat()
+            self.collections.clear()
+            self._max_batch_size: int | None = None
+
+    def check_health(self) -> None:
+        while not self.closed.wait(self.health_check_interval):
+            try:
+                self.client.heartbeat()
+            except Exception:
+                try:
+                    self.connect()
+                except Exception:
+                    pass
+
+    def close(self) -> None:
+        # stops the heartbeat thread, the client can't be used afterwards
+        self.closed.set()
+        self.health_thread.join(timeout=self.health_check_interval)
+        with self.lock:
+            self.collections.clear()
+
+    def call(self, operation: Callable[[], T]) -> T:
+        # retry once on a fresh connection if the server went away or a cached handle is stale
+        try:
+            return operation()
+        except RECONNECT_ERRORS:
+            self.connect()
+            return operation()
 
     def heartbeat(self) -> int:
         return self.client.heartbeat()
 
-    def get_collection(self, name: ChromaCollection) -> Collection:
-        self.client.heartbeat()
-        
-        collection = self.client.get_or_create_collection(
-            name=name.value,
-            embedding_function=BGEEmbeddingFunction(),
-            metadata={
-                    "hnsw:space": "cosine",
-                    "hnsw:search_ef": 100,
-                    "hnsw:construction_ef": 100,
-                }
-        )
-        return collection
+    def get_collection(self, name: ChromaCollection, create: bool = False) -> Collection:
+        # reads and deletes only open existing collections, a query on a missing one raises
+        # InvalidCollectionException instead of creating it empty. Only existing handles are cached
+        with self.lock:
+            if (collection := self.collections.get(name)) is not None:
+                return collection
+
+            if create:
+                collection = self.client.get_or_create_collection(
+                    name=name.value,
+                    embedding_function=BGEEmbeddingFunction(),
+                    metadata={
+                            "hnsw:space": "cosine",
+                            "hnsw:search_ef": 100,
+                            "hnsw:construction_ef": 100,
+                        }
+                )
+            else:
+                collection = self.client.get_collection(name=name.value, embedding_function=BGEEmbeddingFunction())
+            self.collections[name] = collection
+            return collection
 
     
     def delete_collection(self, name: ChromaCollection) -> None:
-        self.client.heartbeat()
-        self.client.delete_collection(name.value)
+        with self.lock:
+            self.collections.pop(name, None)
+            self.call(lambda: self.client.delete_collection(name.value))
+        self.invalidate(name)
+
+    def invalidate(self, name: ChromaCollection) -> None:
+        # cached results of a collection are stale once its documents change
+        with self.generation_lock:
+            self.generations[name] = self.generations.get(name, 0) + 1
+            self.result_cache.invalidate(lambda key: key[0] == name.value)
+
+    def cache_stats(self) -> Dict[str, Dict[str, int | float]]:
+        return {
+            "query_embeddings": self.embedding_cache.stats(),
+            "query_results": self.result_cache.stats(),
+        }
 
     def add_documents(self, 
                       collection_name: ChromaCollection, 
-                      documents: List[str],
-                      metadata: List[Mapping[str, str | int | float | bool]],
+                      documents: OneOrMany[str],
+                      metadata: OneOrMany[Mapping[str, str | int | float | bool]],
                       ids: OneOrMany[ID],
-                      batch_size: int = 1 # 1 is optimal for now
+                      embeddings: Sequence[Sequence[float]] | np.ndarray | None = None,
+                      batch_size: int | None = None # None sizes batches adaptively
                     ) -> None:
-        
-        collection = self.get_collection(collection_name)
-        self.client.heartbeat()
-        
-        # process in batches if the input is large
-        if isinstance(ids, list) and len(ids) > batch_size:
-            for i in tqdm(range(0, len(ids), batch_size), 
-                            desc='Adding documents to Chroma...', 
-                            unit='batch', 
-                            bar_format='{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}]', 
-                            leave=False):
-
-                batch_ids = ids[i:i+batch_size]
-                batch_documents = documents[i:i+batch_size]
-                batch_metadata = metadata[i:i+batch_size]
-                
-                collection.add(
-                    ids=batch_ids,
-                    documents=batch_documents,
-                    metadatas=batch_metadata
-                )
-        else:
-            collection.add(
-                ids=ids,
-                documents=documents,
-                metadatas=metadata
-            )
+        ids = [ids] if isinstance(ids, str) else list(ids)
+        documents = [documents] if isinstance(documents, str) else list(documents)
+        metadata = [metadata] if isinstance(metadata, Mapping) else list(metadata)
+
+        max_batch_size = self.max_batch_size()
+        size = min(batch_size or CHROMA_INITIAL_BATCH_SIZE, max_batch_size)
+
+        # upsert so that re-running an ingestion does not fail on existing ids
+        def upload(start: int, end: int, batch_embeddings: Sequence[Sequence[float]] | np.ndarray) -> float:
+            started = time.perf_counter()
+            self.call(lambda: self.get_collection(collection_name, create=True).upsert(
+                ids=ids[start:end],
+                documents=documents[start:end],
+                metadatas=metadata[start:end],
+                embeddings=batch_embeddings
+            ))
+            return time.perf_counter() - started
+
+        with ThreadPoolExecutor(max_workers=1) as uploader, \
+            tqdm(total=len(ids), 
+                 desc='Adding documents to Chroma...', 
+                 unit='doc', 
+                 bar_format='{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}]', 
+                 leave=False) as progress:
+
+            pending: Future[float] | None = None
+            pending_size = 0
+            start = 0
+            while start < len(ids):
+                end = min(start + size, len(ids))
+                # encode the next batch while the previous one is being uploaded
+                if embeddings is not None:
+                    batch_embeddings = embeddings[start:end]
+                else:
+                    batch_embeddings = encode_batched(documents[start:end]).cpu().numpy()
+
+                if pending is not None:
+                    latency = pending.result()
+                    progress.update(pending_size)
+                    if batch_size is None:
+                        size = self.next_batch_size(size, latency, max_batch_size)
+
+                pending = uploader.submit(upload, start, end, batch_embeddings)
+                pending_size = end - start
+                start = end
+
+            if pending is not None:
+                pending.result()
+                progress.update(pending_size)
+
+        self.invalidate(collection_name)
+
+    def max_batch_size(self) -> int:
+        if self._max_batch_size is None:
+            self._max_batch_size = self.call(self.client.get_max_batch_size)
+        return self._max_batch_size
+
+    @staticmethod
+    def next_batch_size(size: int, latency: float, max_batch_size: int) -> int:
+        # grow while uploads are well under the target latency, back off when they exceed it
+        if latency < CHROMA_TARGET_BATCH_SECONDS / 2:
+            return min(size * 2, max_batch_size)
+        if latency > CHROMA_TARGET_BATCH_SECONDS:
+            return max(size // 2, 1)
+        return size
 
     def query(self, 
               collection_name: ChromaCollection, 
               query: str, 
-              n_results: int = 10) -> QueryResult:
-        # check connection
-        self.client.heartbeat()
-
-        collection = self.client.get_collection(collection_name.value, 
-                                                embedding_function=BGEEmbeddingFunction())
-        if collection is None:
-            raise ValueError(f"Collection {collection_name} not found")
-        
-        results = collection.query(
-            query_texts=[query],
-            n_results=n_results,
-            include=[IncludeEnum.documents, IncludeEnum.metadatas]
-        )
-        return results
+              n_results: int = 10,
+              where: Where | None = None,
+              where_document: WhereDocument | None = None) -> QueryResult:
+        return self.query_many(collection_name, [query], n_results=n_results, 
+                               where=where, where_document=where_document)
+
+    def query_many(self, 
+                   collection_name: ChromaCollection, 
+                   queries: List[str], 
+                   n_results: int = 10,
+                   query_embeddings: np.ndarray | None = None, # precomputed, one row per query
+                   where: Where | None = None,
+                   where_document: WhereDocument | None = None
+                ) -> QueryResult:
+        if not queries:
+            raise ValueError("At least one query is required")
+
+        filters = json.dumps([where, where_document], sort_keys=True)
+        keys: List[ResultKey] = [(collection_name.value, query, n_results, filters) for query in queries]
+        results: Dict[ResultKey, QueryResult] = {}
+        for key in keys:
+            if (cached := self.result_cache.get(key)) is not None:
+                results[key] = cached
+
+        missing = list(dict.fromkeys(key for key in keys if key not in results))
+        if missing:
+            # encode every uncached query in one forward pass and search them in one request
+            if query_embeddings is None:
+                missing_embeddings = self.encode_queries([key[1] for key in missing])
+            else:
+                rows = {query: row for query, row in zip(queries, query_embeddings)}
+                missing_embeddings = np.stack([rows[key[1]] for key in missing])
+
+            generation = self.generations.get(collection_name, 0)
+            fetched = self.call(lambda: self.get_collection(collection_name).query(
+                query_embeddings=missing_embeddings,
+                n_results=n_results,
+                where=where,
+                where_document=where_document,
+                include=[IncludeEnum.documents, IncludeEnum.metadatas]
+            ))
+            with self.generation_lock:
+                # the fetch may have read documents an overlapping add or delete has since replaced
+                cacheable = self.generations.get(collection_name, 0) == generation
+                for key, result in zip(missing, split_query_result(fetched)):
+                    if cacheable:
+                        self.result_cache.put(key, result)
+                    results[key] = result
+
+        return merge_query_results([results[key] for key in keys])
+
+    def encode_queries(self, queries: List[str]) -> np.ndarray:
+        embeddings = self.cached_query_embeddings(queries)
+
+        missing = list(dict.fromkeys(query for query in queries if query not in embeddings))
+        if missing:
+            encoded = dict(zip(missing, encode_text(missing, cache=False).cpu().numpy()))
+            self.cache_query_embeddings(encoded)
+            embeddings.update(encoded)
+
+        return np.stack([embeddings[query] for query in queries])
+
+    def cached_query_embeddings(self, queries: List[str]) -> Dict[str, np.ndarray]:
+        return {query: cached for query in queries if (cached := self.embedding_cache.get(query)) is not None}
+
+    def cache_query_embeddings(self, embeddings: Mapping[str, np.ndarray]) -> None:
+        for query, embedding in embeddings.items():
+            self.embedding_cache.put(query, embedding.copy()) # don't keep the whole batch alive
     
     def delete_documents(self, 
                          collection_name: ChromaCollection, 
                          ids: List[str]) -> None:
-        self.client.heartbeat()
-        collection = self.client.get_collection(collection_name.value)
-        if collection is None:
-            raise ValueError(f"Collection {collection_name} not found")
-        collection.delete(ids=ids)
-
-if os.getenv("QUERY_ONLY_LOCAL") == "1":
-    client = None
-    print("embedding only")
-else:
-    client = ChromaClient()
-    print("Using local ChromaDB")
\ No newline at end of file
+        self.call(lambda: self.get_collection(collection_name).delete(ids=ids))
+        self.invalidate(collection_name)
+
+def build_where(**fields: str | int | float | bool | None) -> Where | None:
+    # equality filters on metadata fields, None values are ignored
+    conditions = [{field: value} for field, value in fields.items() if value is not None]
+    if not conditions:
+        return None
+    if len(conditions) == 1:
+        return cast(Where, conditions[0])
+    return cast(Where, {"$and": conditions})
+
+def split_query_result(results: QueryResult) -> List[QueryResult]:
+    # turn a multi-query result into one single-query result per query, in query order
+    n_queries = len(results["ids"])
+    return [
+        cast(QueryResult, {
+            key: value if key == "included" or value is None else [value[i]]
+            for key, value in results.items()
+        })
+        for i in range(n_queries)
+    ]
+
+def merge_query_results(results: List[QueryResult]) -> QueryResult:
+    # inverse of split_query_result
+    merged: Dict[str, object] = {}
+    for key, value in results[0].items():
+        if key == "included" or value is None:
+            merged[key] = value
+        else:
+            merged[key] = [item for result in results for item in result[key]] # type: ignore
+    return cast(QueryResult, merged)
+
+_client: ChromaClient | None = None
+_client_lock = threading.Lock()
+
+# connect on first use rather than at import time
+def get_client() -> ChromaClient | None:
+    global _client
+    if os.getenv("QUERY_ONLY_LOCAL") == "1":
+        return None
+
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = ChromaClient()
+                print("Using local ChromaDB")
+    return _client
+
+def close_client() -> None:
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
@@ -1,24 +1,232 @@
-from sentence_transformers import SentenceTransformer
-from torch import Tensor
-from torch.cuda import is_available
+from __future__ import annotations
 from bson.binary import Binary
-from bson.binary import BinaryVectorDtype
+from bson.binary import BinaryVectorDtype, VECTOR_SUBTYPE
+from database.embedding_cache import EmbeddingCache
+from typing import TYPE_CHECKING, Any, Callable, List, Sequence
+import numpy as np
+import threading
+import atexit
+import struct
+import os
 
-model = SentenceTransformer(
-            'BAAI/bge-m3',
-            device='cuda' if is_available() else 'cpu'
-        )
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+    from torch import Tensor
+
+MODEL_NAME = 'BAAI/bge-m3'
+MAX_LENGTH = 8192
+# number of sequences per forward pass when encoding in bulk
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "16"))
+
+# set EMBEDDING_WORKERS > 1 to fan large encodes out to a pool of CPU worker processes,
+# each holding its own copy of the model and limited to EMBEDDING_WORKER_THREADS threads
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "0"))
+EMBEDDING_WORKER_THREADS = int(os.getenv("EMBEDDING_WORKER_THREADS", "1"))
+# inputs with fewer texts than this are encoded in-process
+EMBEDDING_POOL_MIN_TEXTS = int(os.getenv("EMBEDDING_POOL_MIN_TEXTS", "64"))
+THREAD_ENV_VARS = ["OMP_NUM_THREADS", "MKL_NUM_THREADS"]
+
+# precisions accepted by encode_text and the BSON vector dtype each one is stored as
+PRECISION_DTYPES = {
+    "float32": BinaryVectorDtype.FLOAT32,
+    "int8": BinaryVectorDtype.INT8,
+    "ubinary": BinaryVectorDtype.PACKED_BIT,
+}
+NUMPY_DTYPES = {
+    BinaryVectorDtype.FLOAT32: np.dtype("<f4"),
+    BinaryVectorDtype.INT8: np.dtype("i1"),
+    BinaryVectorDtype.PACKED_BIT: np.dtype("u1"),
+}
+
+# the model and the cache are created on first use, so importing this module
+# (e.g. from the scrapy settings) does not load torch or the bge-m3 weights
+_model: SentenceTransformer | None = None
+_cache: EmbeddingCache | None = None
+_cache_initialized = False
+_pool: dict[str, Any] | None = None
+_lock = threading.Lock()
+_pool_lock = threading.Lock()
+
+def get_model() -> SentenceTransformer:
+    global _model
+    if _model is None:
+        with _lock:
+            if _model is None:
+                from sentence_transformers import SentenceTransformer
+                from torch.cuda import is_available
+
+                _model = SentenceTransformer(
+                            MODEL_NAME,
+                            device='cuda' if is_available() else 'cpu'
+                        )
+                print("Initialized BGE model with device: ", _model.device)
+    return _model
+
+def get_cache() -> EmbeddingCache | None:
+    global _cache, _cache_initialized
+    if not _cache_initialized:
+        with _lock:
+            # set EMBEDDING_CACHE=0 to always re-encode
+            if not _cache_initialized and os.getenv("EMBEDDING_CACHE", "1") != "0":
+                _cache = EmbeddingCache(
+                            os.getenv("EMBEDDING_CACHE_PATH", ".cache/embeddings.sqlite3"),
+                            max_entries=int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+                        )
+            _cache_initialized = True
+    return _cache
 
-print("Initialized BGE model with device: ", model.device)
+def get_pool() -> dict[str, Any] | None:
+    global _pool
+    if EMBEDDING_WORKERS <= 1:
+        return None
 
-def encode_text(text: str, precision: str = "float32") -> Tensor:
-    return model.encode(
-            text, 
+    if _pool is None:
+        model = get_model()
+        with _pool_lock:
+            if _pool is None:
+                # spawned workers read their thread limits from the environment they start with
+                previous = {name: os.environ.get(name) for name in THREAD_ENV_VARS}
+                os.environ.update({name: str(EMBEDDING_WORKER_THREADS) for name in THREAD_ENV_VARS})
+                try:
+                    _pool = model.start_multi_process_pool(["cpu"] * EMBEDDING_WORKERS)
+                finally:
+                    for name, value in previous.items():
+                        if value is None:
+                            os.environ.pop(name, None)
+                        else:
+                            os.environ[name] = value
+
+                atexit.register(stop_pool)
+                print(f"Started {EMBEDDING_WORKERS} encoding workers with {EMBEDDING_WORKER_THREADS} threads each")
+    return _pool
+
+def stop_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            from sentence_transformers import SentenceTransformer
+            SentenceTransformer.stop_multi_process_pool(_pool)
+            _pool = None
+
+def warmup() -> None:
+    # load the model and run one forward pass so the first request does not pay for it
+    get_model().encode(["warmup"], convert_to_tensor=True)
+
+def _encode(texts: str | List[str], batch_size: int = 32) -> Tensor:
+    if not isinstance(texts, str) and len(texts) >= EMBEDDING_POOL_MIN_TEXTS and (pool := get_pool()):
+        from torch import from_numpy
+        model = get_model()
+        # the pool returns the vectors in input order
+        encoded = model.encode_multi_process(texts, pool, batch_size=batch_size)
+        return from_numpy(encoded).to(model.device)
+
+    return get_model().encode(
+            texts, 
+            batch_size=batch_size,
             convert_to_tensor=True,
-            max_length=8192,
-            truncation=True,
-            precision=precision
+            max_length=MAX_LENGTH,
+            truncation=True
         )
 
-def generate_bson_vector(vector, vector_dtype=BinaryVectorDtype.FLOAT32):
-    return Binary.from_vector(vector, vector_dtype)
\ No newline at end of file
+def _encode_sorted(texts: List[str], batch_size: int) -> Tensor:
+    from torch import empty, tensor
+
+    # sort by character length (longest first) so the chunks handed to the worker pool pad to a
+    # similar length. character length is a cheap proxy for token length, tokenizing the corpus
+    # just to sort it would cost a second pass, and model.encode sorts each chunk itself anyway
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+
+    encoded = _encode([texts[i] for i in order], batch_size=batch_size)
+
+    # scatter the vectors back to the original order
+    results = empty(encoded.shape, dtype=encoded.dtype, device=encoded.device)
+    results[tensor(order, device=encoded.device)] = encoded
+    return results
+
+def _encode_cached(texts: List[str], encode: Callable[[List[str]], Tensor]) -> Tensor:
+    from torch import from_numpy
+
+    cache = get_cache()
+    if cache is None or not texts:
+        return encode(texts)
+
+    # vectors are cached at full precision and quantized on the way out
+    keys = [EmbeddingCache.make_key(MODEL_NAME, "float32", MAX_LENGTH, text) for text in texts]
+    vectors = cache.get_many(keys)
+
+    # only encode texts that are not cached yet, once per distinct text
+    missing = list(dict.fromkeys(key for key in keys if key not in vectors))
+    if missing:
+        missing_texts = {key: text for key, text in zip(keys, texts)}
+        encoded = encode([missing_texts[key] for key in missing]).cpu().numpy()
+        new_vectors = dict(zip(missing, encoded))
+        cache.put_many(new_vectors)
+        vectors.update(new_vectors)
+
+    stacked = from_numpy(np.stack([vectors[key] for key in keys]))
+    # a fully cached batch stays on the cpu, loading the model only to pick its device would
+    # cost more than the whole lookup
+    return stacked.to(_model.device) if _model is not None else stacked
+
+def quantize(vectors: np.ndarray, precision: str) -> np.ndarray:
+    if precision == "float32":
+        return vectors.astype(np.float32, copy=False)
+    if precision == "int8":
+        # bge-m3 vectors are normalized, so every component lies in [-1, 1]
+        return np.clip(np.rint(vectors * 127), -128, 127).astype(np.int8)
+    if precision == "ubinary":
+        # one sign bit per dimension, 8 dimensions per byte
+        return np.packbits(vectors > 0, axis=-1)
+    raise ValueError(f"Unsupported precision {precision}, expected one of {list(PRECISION_DTYPES)}")
+
+def _quantize_tensor(vectors: Tensor, precision: str) -> Tensor:
+    if precision == "float32":
+        return vectors
+
+    from torch import from_numpy
+    return from_numpy(quantize(vectors.cpu().numpy(), precision)).to(vectors.device)
+
+def encode_text(text: str | List[str], precision: str = "float32", cache: bool = True) -> Tensor:
+    # cache=False skips the sqlite cache, for callers that keep their own in memory
+    texts = [text] if isinstance(text, str) else list(text)
+    encoded = _encode_cached(texts, _encode) if cache else _encode(texts)
+    results = _quantize_tensor(encoded, precision)
+    return results[0] if isinstance(text, str) else results
+
+def encode_batched(texts: List[str], 
+                   batch_size: int = EMBEDDING_BATCH_SIZE, 
+                   precision: str = "float32") -> Tensor:
+    if not texts:
+        from torch import empty
+        return empty((0,))
+    results = _encode_cached(texts, lambda missing: _encode_sorted(missing, batch_size))
+    return _quantize_tensor(results, precision)
+
+def embedding_cache_stats() -> dict[str, int | float]:
+    return _cache.stats() if _cache is not None else {}
+
+def generate_bson_vector(vector: Any, vector_dtype: BinaryVectorDtype = BinaryVectorDtype.FLOAT32) -> Binary:
+    if hasattr(vector, "cpu"):
+        vector = vector.cpu().numpy()
+
+    if isinstance(vector, np.ndarray):
+        # pack the array buffer directly instead of going through a list of python numbers
+        metadata = struct.pack("<sB", vector_dtype.value, 0)
+        data = np.ascontiguousarray(vector, dtype=NUMPY_DTYPES[vector_dtype]).tobytes()
+        return Binary(metadata + data, subtype=VECTOR_SUBTYPE)
+
+    return Binary.from_vector(vector, vector_dtype)
+
+def bson_vector_to_array(vector: Binary) -> np.ndarray:
+    dtype = BinaryVectorDtype(vector[:1])
+    return np.frombuffer(vector, dtype=NUMPY_DTYPES[dtype], offset=2)
+
+def rescore(query: np.ndarray, candidates: Sequence[Binary] | np.ndarray, top_k: int) -> List[int]:
+    # rank candidates found with quantized vectors by their full precision float32 copies,
+    # given as stored BSON vectors or as rows of an array
+    if len(candidates) == 0:
+        return []
+    vectors = candidates if isinstance(candidates, np.ndarray) \
+        else np.stack([bson_vector_to_array(candidate) for candidate in candidates])
+    scores = vectors @ np.asarray(query, dtype=np.float32)
+    return np.argsort(-scores, kind="stable")[:top_k].tolist()
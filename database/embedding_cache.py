@@ -0,0 +1,112 @@
+from typing import Dict, List, Mapping
+from hashlib import sha256
+import numpy as np
+import sqlite3
+import threading
+import time
+import os
+
+# sqlite limits the number of bound parameters per statement
+SQLITE_CHUNK_SIZE = 500
+
+# persistent LRU cache of encoded vectors, keyed by model settings and text hash
+class EmbeddingCache:
+    def __init__(self, path: str, max_entries: int) -> None:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                dtype TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )"""
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self.conn.commit()
+
+        # running row count, so inserts don't scan the table to check the bound. other processes
+        # sharing the file make it drift, so it is recounted whenever eviction runs
+        (self.count,) = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+
+    @staticmethod
+    def make_key(model_name: str, precision: str, max_length: int, text: str) -> str:
+        digest = sha256(text.encode("utf-8")).hexdigest()
+        return f"{model_name}:{precision}:{max_length}:{digest}"
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        found: Dict[str, np.ndarray] = {}
+        unique_keys = list(dict.fromkeys(keys))
+
+        with self.lock:
+            for i in range(0, len(unique_keys), SQLITE_CHUNK_SIZE):
+                chunk = unique_keys[i:i+SQLITE_CHUNK_SIZE]
+                rows = self.conn.execute(
+                    f"SELECT key, dtype, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                for key, dtype, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=dtype)
+
+            # refresh recency of the entries we just served
+            now = time.time()
+            self.conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+            self.conn.commit()
+
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+
+        return found
+
+    def put_many(self, vectors: Mapping[str, np.ndarray]) -> None:
+        if not vectors:
+            return
+
+        now = time.time()
+        with self.lock:
+            # a key already present holds the same vector, only its recency changes
+            inserted = self.conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, dtype, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(key, vector.dtype.str, vector.tobytes(), now) for key, vector in vectors.items()]
+            ).rowcount
+            if inserted < len(vectors):
+                self.conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in vectors])
+            self.count += inserted
+
+            if self.count > self.max_entries:
+                self.evict()
+            self.conn.commit()
+
+    def evict(self) -> None:
+        # drop the least recently used entries down to 90% of the bound, so the next
+        # eviction (and its recount) only happens after another 10% of inserts
+        (self.count,) = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        target = int(self.max_entries * 0.9)
+        if self.count > self.max_entries:
+            self.conn.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                (self.count - target,)
+            )
+            self.count = target
+
+    def stats(self) -> Dict[str, int | float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
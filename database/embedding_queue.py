@@ -0,0 +1,108 @@
+from typing import Iterable, List, NamedTuple
+import sqlite3
+import threading
+import time
+import os
+
+class EmbeddingJob(NamedTuple):
+    collection: str
+    id_field: str
+    doc_id: str
+    field: str
+    text: str
+    # set when the job is leased from the queue
+    job_id: int = 0
+    version: int = 0
+
+# durable queue of texts waiting to be embedded and written back to mongo.
+# jobs are leased rather than popped, so a worker that dies mid-batch leaves
+# them to be picked up again once the lease expires
+class EmbeddingQueue:
+
+    def __init__(self, path: str, lease_seconds: float = 600) -> None:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.lock = threading.Lock()
+
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                collection TEXT NOT NULL,
+                id_field TEXT NOT NULL,
+                doc_id TEXT NOT NULL,
+                field TEXT NOT NULL,
+                text TEXT NOT NULL,
+                version INTEGER NOT NULL DEFAULT 0,
+                leased_until REAL NOT NULL DEFAULT 0,
+                UNIQUE (collection, doc_id, field)
+            )"""
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_leased_until ON jobs (leased_until, job_id)")
+
+    def enqueue_many(self, jobs: Iterable[EmbeddingJob]) -> None:
+        # re-enqueuing a document replaces its text instead of adding a duplicate job
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany(
+                """INSERT INTO jobs (collection, id_field, doc_id, field, text) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (collection, doc_id, field) DO UPDATE SET 
+                    text = excluded.text, id_field = excluded.id_field, version = version + 1, leased_until = 0""",
+                [(job.collection, job.id_field, job.doc_id, job.field, job.text) for job in jobs]
+            )
+            self.conn.execute("COMMIT")
+
+    def lease(self, limit: int) -> List[EmbeddingJob]:
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            rows = self.conn.execute(
+                """SELECT collection, id_field, doc_id, field, text, job_id, version FROM jobs 
+                WHERE leased_until < ? ORDER BY job_id LIMIT ?""",
+                (now, limit)
+            ).fetchall()
+            self.conn.executemany(
+                "UPDATE jobs SET leased_until = ? WHERE job_id = ?",
+                [(now + self.lease_seconds, row[5]) for row in rows]
+            )
+            self.conn.execute("COMMIT")
+        return [EmbeddingJob(*row) for row in rows]
+
+    def ack(self, jobs: Iterable[EmbeddingJob]) -> None:
+        # a job whose text changed while it was leased keeps its newer version queued
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany(
+                "DELETE FROM jobs WHERE job_id = ? AND version = ?",
+                [(job.job_id, job.version) for job in jobs]
+            )
+            self.conn.execute("COMMIT")
+
+    def release(self, jobs: Iterable[EmbeddingJob]) -> None:
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany(
+                "UPDATE jobs SET leased_until = 0 WHERE job_id = ?",
+                [(job.job_id,) for job in jobs]
+            )
+            self.conn.execute("COMMIT")
+
+    def __len__(self) -> int:
+        with self.lock:
+            (count,) = self.conn.execute("SELECT COUNT(*) FROM jobs").fetchone()
+        return count
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+def get_embedding_queue() -> EmbeddingQueue:
+    return EmbeddingQueue(
+                os.getenv("EMBEDDING_QUEUE_PATH", ".cache/embedding_queue.sqlite3"),
+                lease_seconds=float(os.getenv("EMBEDDING_QUEUE_LEASE_SECONDS", "600"))
+            )
@@ -0,0 +1,74 @@
+from pymongo import MongoClient
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Dict, Iterator, TypeVar
+import threading
+import os
+import dotenv
+
+dotenv.load_dotenv()
+
+T = TypeVar("T")
+
+# one pooled client per process, shared by the pipelines, spiders and refresh jobs.
+# users acquire it for the duration of a spider or job and the last release closes it
+_client: MongoClient | None = None
+_references = 0
+_lock = threading.Lock()
+
+def client_options() -> Dict[str, Any]:
+    options: Dict[str, Any] = {
+        "maxPoolSize": int(os.getenv("MONGODB_MAX_POOL_SIZE", "50")),
+        "minPoolSize": int(os.getenv("MONGODB_MIN_POOL_SIZE", "0")),
+        "connectTimeoutMS": int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", "10000")),
+        "serverSelectionTimeoutMS": int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "30000")),
+        "retryWrites": True,
+        # zstd and snappy need their optional packages, zlib is always available
+        "compressors": os.getenv("MONGODB_COMPRESSORS", "zlib"),
+    }
+    if write_concern := os.getenv("MONGODB_WRITE_CONCERN"):
+        options["w"] = int(write_concern) if write_concern.isdigit() else write_concern
+    return options
+
+def _get_mongo_client() -> MongoClient:
+    # callers hold _lock
+    global _client
+    if _client is None:
+        _client = MongoClient(os.getenv("MONGODB_URI"), **client_options())
+    return _client
+
+def get_mongo_client() -> MongoClient:
+    with _lock:
+        return _get_mongo_client()
+
+def acquire_mongo_client() -> MongoClient:
+    # counted under the same lock the client is fetched with, otherwise a concurrent last
+    # release could close it in between
+    global _references
+    with _lock:
+        _references += 1
+        return _get_mongo_client()
+
+def release_mongo_client() -> None:
+    global _client, _references
+    with _lock:
+        _references = max(_references - 1, 0)
+        if _references == 0 and _client is not None:
+            _client.close()
+            _client = None
+
+@contextmanager
+def mongo_client() -> Iterator[MongoClient]:
+    client = acquire_mongo_client()
+    try:
+        yield client
+    finally:
+        release_mongo_client()
+
+def mongo_job(function: Callable[..., T]) -> Callable[..., T]:
+    # keeps the shared client open for the whole job, including nested jobs
+    @wraps(function)
+    def wrapper(*args: Any, **kwargs: Any) -> T:
+        with mongo_client():
+            return function(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,88 @@
+from collections import OrderedDict
+from typing import Callable, Dict, Generic, Hashable, TypeVar
+import threading
+import time
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+# bounded in-memory LRU cache with hit/miss counters
+class LRUCache(Generic[K, V]):
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self.entries: OrderedDict[K, V] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: K) -> V | None:
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+    def put(self, key: K, value: V) -> None:
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, predicate: Callable[[K], bool]) -> None:
+        with self.lock:
+            for key in [key for key in self.entries if predicate(key)]:
+                del self.entries[key]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> Dict[str, int | float]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+# LRU cache whose entries also expire ttl seconds after they were stored
+class TTLCache(LRUCache[K, V]):
+
+    def __init__(self, max_entries: int, ttl: float) -> None:
+        super().__init__(max_entries)
+        self.ttl = ttl
+        self.expires: Dict[K, float] = {}
+
+    def get(self, key: K) -> V | None:
+        with self.lock:
+            expires_at = self.expires.get(key)
+            if expires_at is not None and expires_at < time.monotonic():
+                self.entries.pop(key, None)
+                del self.expires[key]
+        return super().get(key)
+
+    def put(self, key: K, value: V) -> None:
+        super().put(key, value)
+        with self.lock:
+            self.expires[key] = time.monotonic() + self.ttl
+            # forget expiry times of entries the LRU bound already evicted
+            if len(self.expires) > 2 * len(self.entries) + 1:
+                self.expires = {key: self.expires[key] for key in self.entries if key in self.expires}
+
+    def invalidate(self, predicate: Callable[[K], bool]) -> None:
+        super().invalidate(predicate)
+        with self.lock:
+            self.expires = {key: self.expires[key] for key in self.entries if key in self.expires}
+
+    def clear(self) -> None:
+        super().clear()
+        with self.lock:
+            self.expires.clear()
@@ -0,0 +1,11 @@
+from scrapy.extensions.httpcache import RFC2616Policy
+from scrapy.http import Request, Response
+
+# revalidates every cached page with If-None-Match/If-Modified-Since instead of trusting its
+# freshness lifetime, so a recrawl sees every change but only downloads the pages that changed.
+# RFC2616Policy refetches pages sent with Cache-Control: no-cache without any validators
+class ConditionalRequestPolicy(RFC2616Policy):
+
+    def is_cached_response_fresh(self, cachedresponse: Response, request: Request) -> bool:
+        self._set_conditional_validators(request, cachedresponse)
+        return False
@@ -3,7 +3,12 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
-from scrapy import signals
+from scrapy import Request, signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import Response
+from scrapy.settings import BaseSettings
+from typing import Mapping, Set, Tuple
+import hashlib
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
@@ -101,3 +106,97 @@ class EcalendarDownloaderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+
+def skips_unchanged(settings: BaseSettings) -> bool:
+    return settings.getbool("SKIP_UNCHANGED_PAGES")
+
+
+def page_version(response: Response) -> str:
+    # the same for a page revalidated with a 304, which gets the cached body back
+    return hashlib.sha1(response.body).hexdigest()
+
+
+# versions of the pages whose items are already stored, loaded by the item pipeline from the
+# documents it wrote. a page is only skipped when its version is stored, so a page whose items
+# never reached mongo (crash, failed write, dropped collection) is parsed again
+class PageVersions:
+
+    def __init__(self, stored: Mapping[str, str]) -> None:
+        self.stored = dict(stored)
+        # urls skipped in this crawl, they are still on the site
+        self.unchanged: Set[str] = set()
+
+    def is_unchanged(self, response: Response) -> bool:
+        if self.stored.get(response.url) != page_version(response):
+            return False
+        self.unchanged.add(response.url)
+        return True
+
+
+class SkipUnchangedDownloaderMiddleware:
+    # drops pages whose items are stored with the same version before they are parsed. requests
+    # with meta["parse_unchanged"] still reach their callback, e.g. to follow the links of the page.
+    # the pipeline sets spider.page_versions, nothing is skipped without it
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not skips_unchanged(crawler.settings):
+            raise NotConfigured
+        return cls(crawler.stats)
+
+    def process_response(self, request, response, spider):
+        versions: PageVersions | None = getattr(spider, "page_versions", None)
+        if versions is None or request.meta.get("parse_unchanged") or not versions.is_unchanged(response):
+            return response
+
+        self.stats.inc_value("unchanged_pages/skipped", spider=spider)
+        raise IgnoreRequest(f"Unchanged since its items were stored: {response.url}")
+
+
+class SkipUnchangedSpiderMiddleware:
+    # keeps the requests of unchanged pages that were parsed anyway but drops their items, so the
+    # pipelines do not rewrite or re-embed them. the items of other pages get the page's version
+    # in item["page_version"] for the pipeline to store
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not skips_unchanged(crawler.settings):
+            raise NotConfigured
+        return cls(crawler.stats)
+
+    def version(self, response, spider) -> Tuple[bool, str | None]:
+        # (unchanged, version to stamp on the items)
+        versions: PageVersions | None = getattr(spider, "page_versions", None)
+        if versions is None:
+            return False, None
+        return versions.is_unchanged(response), page_version(response)
+
+    def filter(self, i, unchanged: bool, version: str | None, spider):
+        if isinstance(i, Request):
+            return i
+        if unchanged:
+            self.stats.inc_value("unchanged_pages/items_dropped", spider=spider)
+            return None
+        if version is not None and isinstance(i, dict):
+            i["page_version"] = version
+        return i
+
+    def process_spider_output(self, response, result, spider):
+        unchanged, version = self.version(response, spider)
+        for i in result:
+            if (i := self.filter(i, unchanged, version, spider)) is not None:
+                yield i
+
+    async def process_spider_output_async(self, response, result, spider):
+        # same as process_spider_output, for spiders with async callbacks
+        unchanged, version = self.version(response, spider)
+        async for i in result:
+            if (i := self.filter(i, unchanged, version, spider)) is not None:
+                yield i
@@ -0,0 +1,98 @@
+from bs4 import BeautifulSoup, SoupStrainer
+from typing import Any, Callable, Dict, Iterable, List
+from pathlib import Path
+import tracemalloc
+import time
+import sys
+
+# "html.parser" is pure python, "lxml" builds the same tree with the C parser that scrapy
+# already depends on, "lxml-strainer" also skips everything outside the spider's strainer
+PARSER_BACKENDS = ("html.parser", "lxml", "lxml-strainer")
+DEFAULT_PARSER = "html.parser"
+
+# keeps the top level tags accepted by `match(name, attrs)`, with everything inside them.
+# bs4 only asks the strainer about tags and strings outside the ones it already kept
+class TagStrainer(SoupStrainer):
+
+    def __init__(self, match: Callable[[str, Dict[str, Any]], bool]) -> None:
+        super().__init__()
+        self.match = match
+
+    def allow_tag_creation(self, nsprefix: str | None, name: str, attrs: Dict[str, Any] | None) -> bool:
+        return self.match(name, attrs or {})
+
+    def allow_string_creation(self, string: str) -> bool:
+        return False
+
+def _classes(attrs: Dict[str, Any]) -> List[str]:
+    # the class attribute is not split into a list yet while parsing
+    classes = attrs.get("class") or []
+    return classes.split() if isinstance(classes, str) else classes
+
+def _faculty_element(name: str, attrs: Dict[str, Any]) -> bool:
+    if name == "a":
+        return "href" in attrs
+    return name == "div" and ("panel" in _classes(attrs) or attrs.get("id") == "headercontainer")
+
+def _program_element(name: str, attrs: Dict[str, Any]) -> bool:
+    return name == "div" and "node-program" in _classes(attrs)
+
+# only the parts of a page each spider reads: panels, the header and links for the
+# faculty pages, the program node for the programs
+FACULTY_STRAINER = TagStrainer(_faculty_element)
+PROGRAM_STRAINER = TagStrainer(_program_element)
+
+STRAINERS = {
+    "cs_faculty": FACULTY_STRAINER,
+    "programs": PROGRAM_STRAINER,
+}
+
+def make_soup(text: str, backend: str = DEFAULT_PARSER, strainer: SoupStrainer | None = None) -> BeautifulSoup:
+    if backend == "html.parser":
+        return BeautifulSoup(text, "html.parser")
+    if backend == "lxml":
+        return BeautifulSoup(text, "lxml")
+    if backend == "lxml-strainer":
+        return BeautifulSoup(text, "lxml", parse_only=strainer)
+    raise ValueError(f"Unknown parser backend {backend}, expected one of {', '.join(PARSER_BACKENDS)}")
+
+def spider_parser(spider: Any) -> str:
+    # `scrapy crawl <spider> -a parser=lxml` overrides the HTML_PARSER setting
+    backend = getattr(spider, "parser", None) or spider.settings.get("HTML_PARSER", DEFAULT_PARSER)
+    if backend not in PARSER_BACKENDS:
+        raise ValueError(f"Unknown parser backend {backend}, expected one of {', '.join(PARSER_BACKENDS)}")
+    return backend
+
+def benchmark_parsers(pages: Iterable[str], strainer: SoupStrainer | None = None, rounds: int = 3) -> None:
+    # pages/sec and peak python memory of building the soup of each saved page with every backend
+    texts: List[str] = [Path(page).read_text(encoding="utf-8", errors="replace") for page in pages]
+    if not texts:
+        raise ValueError("No pages to benchmark")
+
+    print(f"{len(texts)} pages, {sum(len(text) for text in texts) / 1e6:.2f} MB")
+    print(f"{'backend':<16}{'pages/s':>10}{'peak MB':>10}")
+    for backend in PARSER_BACKENDS:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for text in texts:
+                make_soup(text, backend, strainer)
+        elapsed = time.perf_counter() - start
+
+        # measured separately, tracing slows down the parse itself
+        tracemalloc.start()
+        for text in texts:
+            soup = make_soup(text, backend, strainer)
+            del soup
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(f"{backend:<16}{len(texts) * rounds / elapsed:>10.1f}{peak / 1e6:>10.2f}")
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+
+    if len(args) < 2 or args[0] not in STRAINERS:
+        print(f"Usage: python -m ecalendar.parsers <{'|'.join(STRAINERS)}> <page.html>...")
+        sys.exit(1)
+
+    benchmark_parsers(args[1:], STRAINERS[args[0]])
@@ -6,16 +6,80 @@
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
-from pymongo import MongoClient
+from pymongo import DeleteMany, UpdateMany, UpdateOne
 from dotenv import load_dotenv
-from scrapy import Spider
+from scrapy import Spider, signals
+from pymongo.collection import Collection
+from ecalendar.middlewares import PageVersions, skips_unchanged
+from twisted.internet import task
+from twisted.internet.defer import Deferred, DeferredList
+from twisted.internet.threads import deferToThread, deferToThreadPool
+from twisted.python.threadpool import ThreadPool
 import os
+from collections import defaultdict
 from tqdm import tqdm
+from database.embedding_queue import EmbeddingJob, get_embedding_queue
+from database.bulk_writer import BulkWriteBuffer, WriteOperation
+from database.mongo import acquire_mongo_client, release_mongo_client
 load_dotenv()
-from typing import List, Callable, Mapping
+from typing import Any, Dict, List, Set
 import json
 from urllib.parse import urljoin
-from database.embbedings import encode_text, generate_bson_vector
+from database.embbedings import encode_text, generate_bson_vector, embedding_cache_stats
+
+def stored_page_versions(collection: Collection) -> Dict[str, str]:
+    # url -> page_version of the pages whose documents all carry the same version, a page with
+    # a document written without it (new chunk, failed version update) is not considered stored
+    pipeline = [
+        {"$group": {"_id": "$url", "versions": {"$addToSet": {"$ifNull": ["$page_version", None]}}}},
+        {"$match": {"versions": {"$size": 1}, "versions.0": {"$ne": None}}},
+    ]
+    return {doc["_id"]: doc["versions"][0] for doc in collection.aggregate(pipeline)}
+
+# flushes a BulkWriteBuffer on twisted's thread pool so mongo round trips don't block the reactor
+class BufferedWriter:
+
+    def __init__(self, buffer: BulkWriteBuffer, spider: Spider) -> None:
+        self.buffer = buffer
+        self.spider = spider
+        self.pending: set[Deferred] = set()
+        # flush on the time threshold even when no new items arrive
+        self.timer = task.LoopingCall(self.flush_if_due)
+        self.timer.start(buffer.max_seconds, now=False)
+
+    def add(self, operation: WriteOperation) -> None:
+        if self.buffer.add(operation):
+            self.flush()
+
+    def flush_if_due(self) -> None:
+        if self.buffer.is_due():
+            self.flush()
+
+    def flush(self) -> None:
+        operations = self.buffer.take()
+        if not operations:
+            return
+
+        deferred = deferToThread(self.buffer.write, operations)
+        self.pending.add(deferred)
+        deferred.addErrback(lambda failure: self.spider.logger.error(f"Bulk write failed: {failure.value}"))
+        deferred.addBoth(lambda _: self.pending.discard(deferred))
+
+    def close(self) -> Deferred:
+        if self.timer.running:
+            self.timer.stop()
+        self.flush()
+        return DeferredList(list(self.pending))
+
+    def log_stats(self, name: str) -> None:
+        stats = self.buffer.stats()
+        for key, value in stats.items():
+            self.spider.crawler.stats.set_value(f"mongodb/{name}/{key}", value)
+        self.spider.logger.info(
+            f"{name}: wrote {stats['written']} operations in {stats['flushes']} bulk writes "
+            f"(mean {stats['mean_flush_seconds']:.3f}s, max {stats['max_flush_seconds']:.3f}s), "
+            f"{stats['retried']} retried, {stats['failed']} failed"
+        )
 
 class MongoDBProgramPipeline:
     collection_name_map = {
@@ -34,7 +98,7 @@ class MongoDBProgramPipeline:
     }
 
     def open_spider(self, spider: Spider):
-        self.client = MongoClient(os.getenv("MONGODB_URI"))
+        self.client = acquire_mongo_client()
         self.db = self.client[os.getenv("MONGODB_DATABASE_NAME")]
         self.progress = tqdm(colour="green")
         self.collection_name = self.collection_name_map[spider.name] + "_" + os.getenv("YEAR").replace("-", "_")
@@ -50,14 +114,31 @@ class MongoDBProgramPipeline:
             self.collection = self.db.create_collection(self.collection_name)
         else:
             self.collection = self.db[self.collection_name]
+            # one document per page, its version is written with the same update as its content
+            if skips_unchanged(spider.settings):
+                spider.page_versions = PageVersions(stored_page_versions(self.collection))
+
+        self.writer = BufferedWriter(
+            BulkWriteBuffer(
+                self.collection,
+                max_operations=spider.settings.getint("MONGODB_BULK_MAX_OPERATIONS", 500),
+                max_seconds=spider.settings.getfloat("MONGODB_BULK_MAX_SECONDS", 2.0)
+            ),
+            spider
+        )
 
     def close_spider(self, spider: Spider):
-        self.client.close()
-        self.progress.close()
+        # wait for the last writes before releasing the shared client
+        def close(_):
+            self.writer.log_stats(self.collection_name)
+            release_mongo_client()
+            self.progress.close()
+
+        return self.writer.close().addBoth(close)
 
     def process_item(self, item, spider: Spider):
         item_id = item[self.id_field]
-        self.collection.update_one({self.id_field: item_id}, {"$set": ItemAdapter(item).asdict()}, upsert=True)
+        self.writer.add(UpdateOne({self.id_field: item_id}, {"$set": ItemAdapter(item).asdict()}, upsert=True))
         self.progress.update(1)
         return item
 
@@ -84,10 +165,12 @@ class MongoDBFacultyPipeline:
     }
 
     def open_spider(self, spider: Spider):
-        self.client = MongoClient(os.getenv("MONGODB_URI"))
+        self.client = acquire_mongo_client()
         self.db = self.client[os.getenv("MONGODB_DATABASE_NAME")]
         self.collection_name = "general_" + os.getenv("YEAR").replace("-", "_")
-        self.mode = "create"
+        # pages skipped as unchanged keep their chunks, so the collection is not recreated and the
+        # pages that were removed from the site are deleted once the crawl finished instead
+        self.mode = "update" if skips_unchanged(spider.settings) else "create"
         self.id_field = "url"
         self.domain = "www.cs.mcgill.ca"
         self.base_url = f"https://{self.domain}"
@@ -102,18 +185,67 @@ class MongoDBFacultyPipeline:
         else:
             self.collection = self.db[self.collection_name]
 
-        self.encode: Callable[[str], List[float]] = lambda x: encode_text(x).squeeze().tolist()
+        self.page_versions: PageVersions | None = None
+        self.seen: Set[str] = set()
+        if self.mode == "update":
+            self.page_versions = spider.page_versions = PageVersions(stored_page_versions(self.collection))
+        # the sweep needs the finish reason, which only the spider_closed signal has
+        spider.crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+
         self.progress = tqdm(colour="green")
+        # used for its retry and latency bookkeeping, each page is written with one bulk write
+        self.writes = BulkWriteBuffer(self.collection)
+
+        # "queue" stores the chunks and leaves encoding to embed_worker.py, "inline" encodes them here
+        self.embedding_mode = spider.settings.get("FACULTY_EMBEDDING_MODE", "queue")
+        self.queue = get_embedding_queue() if self.embedding_mode == "queue" else None
+        # inline encoding gets its own single thread instead of holding the reactor's shared pool,
+        # which also runs dns lookups and the other pipelines' bulk writes
+        self.encode_pool: ThreadPool | None = None
+        if self.queue is None:
+            self.encode_pool = ThreadPool(minthreads=1, maxthreads=1, name="faculty-encode")
+            self.encode_pool.start()
 
     def close_spider(self, spider: Spider):
-        self.client.close()
         self.progress.close()
+        spider.logger.info(f"{self.collection_name}: {self.writes.stats()}")
+
+        if self.encode_pool is not None:
+            self.encode_pool.stop()
+
+        if self.queue is not None:
+            spider.logger.info(f"{len(self.queue)} chunks waiting in the embedding queue")
+            self.queue.close()
+
+        if stats := embedding_cache_stats():
+            spider.logger.info(f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses")
+
+    def spider_closed(self, spider: Spider, reason: str):
+        try:
+            if self.page_versions is not None:
+                self.sweep(spider, reason)
+        finally:
+            release_mongo_client()
+
+    def sweep(self, spider: Spider, reason: str):
+        # an interrupted crawl or failed downloads did not see every page that is still on the site
+        stats = spider.crawler.stats.get_stats()
+        errors = stats.get("downloader/exception_count", 0) \
+            + sum(count for key, count in stats.items() if key.startswith("downloader/response_status_count/5"))
+        seen = self.seen | self.page_versions.unchanged
+        if reason != "finished" or errors or not seen:
+            spider.logger.info(f"Not deleting removed pages from {self.collection_name} ({reason}, {errors} errors)")
+            return
+
+        deleted = self.collection.delete_many({"url": {"$nin": sorted(seen)}}).deleted_count
+        spider.logger.info(f"Deleted {deleted} chunks of pages no longer on the site from {self.collection_name}")
 
     def process_item(self, item, spider: Spider):
         if item is None: return
 
 
         url: str = item["url"]
+        version: str | None = item.pop("page_version", None)
         content: dict = item["content"]
 
         # print(url)
@@ -134,29 +266,66 @@ class MongoDBFacultyPipeline:
         
         # print(documents)
         
-        docs: List[Mapping[str, str | int | float | bool]] = [
+        docs: List[Dict[str, Any]] = [
             {   
                 "id": f"{idx}-{self.domain + url}",
                 # "faculty": department,
                 "tags": tag,
                 "url": urljoin(self.base_url, url),
                 "content": documents[idx],
-                "embeddings": generate_bson_vector(self.encode(documents[idx]))
             }
             for idx, tag in enumerate(tags)
         ]
 
         # print(docs)
 
-        for doc in docs:
-            self.collection.update_one(
-                {"id": doc["id"]}, 
-                {"$set": doc}, 
-                upsert=True
+        self.seen.add(urljoin(self.base_url, url))
+        # encoding and writing happen off the reactor thread
+        def stored(_) -> Deferred:
+            return deferToThread(self.store, urljoin(self.base_url, url), docs, version)
+
+        if self.encode_pool is None or not docs:
+            return stored(None).addCallback(lambda _: item)
+
+        from twisted.internet import reactor # the one scrapy installed
+        return deferToThreadPool(reactor, self.encode_pool, self.encode, docs) \
+            .addCallback(stored) \
+            .addCallback(lambda _: item)
+
+    def encode(self, docs: List[Dict[str, Any]]) -> None:
+        # one forward pass for every chunk of the page, packed straight from the array
+        vectors = encode_text([doc["content"] for doc in docs]).cpu().numpy()
+        for doc, vector in zip(docs, vectors):
+            doc["embeddings"] = generate_bson_vector(vector)
+
+    def store(self, url: str, docs: List[Dict[str, Any]], version: str | None = None) -> None:
+        # in update mode a changed page can have fewer chunks than before
+        stale: List[WriteOperation] = []
+        if self.mode == "update":
+            stale.append(DeleteMany({"url": url, "id": {"$nin": [doc["id"] for doc in docs]}}))
+
+        if not docs:
+            self.writes.write(stale)
+            return
+
+        # a queued chunk drops the vector of its previous content, otherwise it would be exported
+        # next to the new text until the worker gets to it
+        update: Dict[str, Any] = {"$unset": {"embeddings": ""}} if self.queue is not None else {}
+        failed = self.writes.write(stale + [
+            UpdateOne({"id": doc["id"]}, {"$set": doc, **update}, upsert=True) for doc in docs
+        ])
+        self.progress.update(len(docs))
+
+        # enqueue only once the chunks exist, the worker updates them in place
+        if self.queue is not None:
+            self.queue.enqueue_many(
+                EmbeddingJob(self.collection_name, "id", doc["id"], "embeddings", doc["content"]) for doc in docs
             )
-            self.progress.update(1)
-        
-        return item
+
+        # the version marks the page as stored, so it is only written once every chunk is written
+        # and queued for encoding. a failed enqueue raises before it and the page is parsed again
+        if version is not None and not failed:
+            self.writes.write([UpdateMany({"url": url}, {"$set": {"page_version": version}})])
 
     def chunk_content(self, content: str, size: int=500, overlap: int=100) -> List[str]:
         words = content.split(" ")
@@ -167,9 +336,11 @@ class MongoDBFacultyPipeline:
 
 
 class MongoDBCoursePipeline:
+    # ids per $in clause of the level updates
+    update_chunk_size = 5000
     
     def open_spider(self, spider: Spider):
-        self.client = MongoClient(os.getenv("MONGODB_URI"))
+        self.client = acquire_mongo_client()
         self.db = self.client[os.getenv("MONGODB_DATABASE_NAME")]
         self.collection_name = "courses_" + os.getenv("YEAR").replace("-", "_")
         self.mode = "update"
@@ -179,13 +350,38 @@ class MongoDBCoursePipeline:
 
         self.collection = self.db[self.collection_name]
 
-        self.progress = tqdm(colour="green", total=self.collection.count_documents({}))
+        # load the existing ids once so items can be matched in memory
+        self.course_ids: Set[str] = {
+            doc["id"] for doc in self.collection.find({}, {"id": 1, "_id": 0}).batch_size(10000) if "id" in doc
+        }
+        self.ids_by_level: Dict[int, Set[str]] = defaultdict(set)
+        self.unmatched: List[str] = []
+
+        self.progress = tqdm(colour="green", total=len(self.course_ids))
         self.level_map = {
             "graduate, undergraduate": 0,
             "undergraduate": 1,
             "graduate": 2,
         }
 
+    def close_spider(self, spider: Spider):
+        # one UpdateMany per level (and per chunk of ids) instead of one update per course
+        operations: List[WriteOperation] = [
+            UpdateMany({ "id": { "$in": chunk } }, { "$set": { "level": level } })
+            for level, ids in self.ids_by_level.items()
+            for chunk in self.chunks(sorted(ids), self.update_chunk_size)
+        ]
+        writes = BulkWriteBuffer(self.collection)
+        writes.write(operations)
+
+        matched = sum(len(ids) for ids in self.ids_by_level.values())
+        spider.logger.info(f"Set the level of {matched} courses with {len(operations)} updates: {writes.stats()}")
+        if self.unmatched:
+            spider.logger.warning(f"{len(self.unmatched)} courses not found in {self.collection_name}: {', '.join(self.unmatched)}")
+
+        release_mongo_client()
+        self.progress.close()
+
     def process_item(self, item: dict, spider: Spider):
         # print(item)
 
@@ -197,12 +393,14 @@ class MongoDBCoursePipeline:
 
         # if (level == 0): print(id, level)
 
-        result = self.collection.update_one(
-            { "id": id },
-            { "$set": { "level": level } }
-        )
+        if id in self.course_ids:
+            self.ids_by_level[level].add(id)
+            self.progress.update(1)
+        else:
+            self.unmatched.append(id)
 
-        if result.modified_count == 1: self.progress.update(1)
-        else: print(id, level)
+        return item
 
-        return item
\ No newline at end of file
+    @staticmethod
+    def chunks(values: List[str], size: int) -> List[List[str]]:
+        return [values[i:i+size] for i in range(0, len(values), size)]
@@ -45,15 +45,16 @@ DOWNLOAD_DELAY = 0.5
 
 # Enable or disable spider middlewares
 # See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-#SPIDER_MIDDLEWARES = {
-#    "ecalender.middlewares.EcalenderSpiderMiddleware": 543,
-#}
+SPIDER_MIDDLEWARES = {
+   "ecalendar.middlewares.SkipUnchangedSpiderMiddleware": 543,
+}
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
-#    "ecalender.middlewares.EcalenderDownloaderMiddleware": 543,
-#}
+DOWNLOADER_MIDDLEWARES = {
+   # below HttpCacheMiddleware (900) so it sees the responses the cache validated
+   "ecalendar.middlewares.SkipUnchangedDownloaderMiddleware": 875,
+}
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
@@ -69,6 +70,22 @@ ITEM_PIPELINES = {
    MongoDBCoursePipeline: 300
 }
 
+# pipelines buffer mongo writes and flush them in unordered bulk writes once either limit is hit
+MONGODB_BULK_MAX_OPERATIONS = 500
+MONGODB_BULK_MAX_SECONDS = 2.0
+
+# "queue" makes MongoDBFacultyPipeline store chunks without embeddings and enqueue them
+# for `just embed-worker`, "inline" encodes them inside the crawl
+FACULTY_EMBEDDING_MODE = "queue"
+
+# CSFacultySpider reads the content and the links of a page from one download,
+# override with `scrapy crawl cs_faculty -a single_pass=0`
+FACULTY_SINGLE_PASS = True
+
+# BeautifulSoup backend of the spiders: "html.parser", "lxml" or "lxml-strainer", which only
+# builds the elements the spider reads. override with `scrapy crawl <spider> -a parser=...`
+HTML_PARSER = "lxml-strainer"
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
 #AUTOTHROTTLE_ENABLED = True
@@ -84,11 +101,17 @@ ITEM_PIPELINES = {
 
 # Enable and configure HTTP caching (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
-#HTTPCACHE_ENABLED = True
-#HTTPCACHE_EXPIRATION_SECS = 0
-#HTTPCACHE_DIR = "httpcache"
-#HTTPCACHE_IGNORE_HTTP_CODES = []
-#HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
+HTTPCACHE_ENABLED = True
+HTTPCACHE_EXPIRATION_SECS = 0
+HTTPCACHE_DIR = "httpcache"
+HTTPCACHE_IGNORE_HTTP_CODES = []
+HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
+# stores the ETag/Last-Modified of each page and revalidates it with a conditional request
+HTTPCACHE_POLICY = "ecalendar.httpcache.ConditionalRequestPolicy"
+# pages whose items are already stored with the same page version are dropped before parsing
+# (see ecalendar.middlewares.PageVersions). the faculty pipeline then updates its collection
+# instead of recreating it and deletes the pages it did not see at the end of a finished crawl
+SKIP_UNCHANGED_PAGES = True
 
 # Set settings whose default value is deprecated to a future-proof value
 TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
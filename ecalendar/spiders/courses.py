@@ -19,8 +19,9 @@ class CoursesMetaSpider(Spider):
         self.start_urls = [self.domain + "/study/" + self.year + "/courses/search?page=0"]
 
     def start_requests(self) -> Iterable[Request]:
+        # unchanged search pages are still parsed to reach the next page, their items are dropped
         for url in self.start_urls:
-            yield Request(url, callback=self.parse)
+            yield Request(url, callback=self.parse, meta={"parse_unchanged": True})
 
     def parse(self, response: Response, **kwargs: Any) -> Any:
         for course_card in response.css("div.views-row"):
@@ -42,4 +43,4 @@ class CoursesMetaSpider(Spider):
             
         next_page = response.css("li.pager-next a::attr(href)").get()
         if next_page:
-            yield Request(self.domain + next_page, callback=self.parse)
\ No newline at end of file
+            yield Request(self.domain + next_page, callback=self.parse, meta={"parse_unchanged": True})
\ No newline at end of file
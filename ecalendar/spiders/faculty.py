@@ -1,14 +1,21 @@
 from collections.abc import Iterable
 from scrapy import Spider
-from scrapy.http import Response, Request
-import httpx
-from typing import Any, Dict, Set, List
+from scrapy.http import Response, Request, TextResponse
+from typing import Any, Dict, Set, List, Tuple
 from urllib.parse import urljoin, urlparse
 from bs4 import BeautifulSoup, Tag
+from ecalendar.parsers import make_soup, spider_parser, DEFAULT_PARSER, FACULTY_STRAINER
 from dotenv import load_dotenv
-import tqdm
+import os
 load_dotenv()
 
+HEADERS = ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']
+
+# minimum delay between two requests to the site and the most requests in flight at once,
+# autothrottle slows down from there when the site responds slowly
+FACULTY_DOWNLOAD_DELAY = float(os.getenv("FACULTY_DOWNLOAD_DELAY", "0.25"))
+FACULTY_CONCURRENT_REQUESTS = int(os.getenv("FACULTY_CONCURRENT_REQUESTS", "4"))
+
 class CSFacultySpider(Spider):
     name = "cs_faculty"
     
@@ -20,81 +27,115 @@ class CSFacultySpider(Spider):
         self.all_urls: Set[str] = set()
         self.is_header_crawled = False
 
+    custom_settings = {
+        # discovery runs through the scheduler, autothrottle paces it above the minimum delay
+        "DOWNLOAD_DELAY": FACULTY_DOWNLOAD_DELAY,
+        "AUTOTHROTTLE_ENABLED": True,
+        # autothrottle never lowers the delay on non-200 responses, so a recrawl answered with
+        # 304s by the http cache revalidation stays at the start delay
+        "AUTOTHROTTLE_START_DELAY": FACULTY_DOWNLOAD_DELAY,
+        "AUTOTHROTTLE_TARGET_CONCURRENCY": float(FACULTY_CONCURRENT_REQUESTS),
+        "CONCURRENT_REQUESTS_PER_DOMAIN": FACULTY_CONCURRENT_REQUESTS,
+    }
+
     def start_requests(self) -> Iterable[Request]:
-        # Start with the base URL
-        self.get_all_urls()
-        for endpoint in self.all_urls:
-            yield Request(urljoin(f"https://{self.base_url}", endpoint), callback=self.parse)
+        # single pass reads links and content from the same response, -a single_pass=0 downloads
+        # every page twice, once for its links and once for its content
+        single_pass = getattr(self, "single_pass", None)
+        if single_pass is None:
+            self.single_pass = self.settings.getbool("FACULTY_SINGLE_PASS", True)
+        else:
+            self.single_pass = str(single_pass).lower() not in ("0", "false", "no")
+        self.parser = spider_parser(self)
+
+        # Start with the base URL, pages are requested as soon as their links are discovered
+        # pages are still parsed for their links when they are unchanged
+        yield Request(f"https://{self.base_url}/", callback=self.discover, meta={"parse_unchanged": True})
 
     def parse(self, response: Response, **kwargs: Any) -> Any:
+        if not isinstance(response, TextResponse):
+            return
+
+        soup = self.make_soup(response.text)
+
+        # a single pass request reaches parse even when the page is unchanged, to follow its links.
+        # its items are already stored, so only the links are read
+        versions = getattr(self, "page_versions", None)
+        if self.single_pass and versions is not None and versions.is_unchanged(response):
+            self.crawler.stats.inc_value("unchanged_pages/skipped", spider=self)
+            yield from self.follow_links(response, soup)
+            return
+
         # Process the current page content
-        content_dict = self.fetch_content(response.text, response.url)
+        content_dict = self.fetch_content(soup, response.url)
 
         yield {
             "url": urlparse(response.url).path,
             "content": content_dict
         }
 
+        if self.single_pass:
+            yield from self.follow_links(response, soup)
+
+    def discover(self, response: Response, **kwargs: Any) -> Iterable[Request]:
+        # pdfs and other files are linked too, but only html pages have more links
+        if not isinstance(response, TextResponse):
+            return
+
+        yield from self.follow_links(response, self.make_soup(response.text))
+
+    def follow_links(self, response: Response, soup: BeautifulSoup) -> Iterable[Request]:
+        # endpoints are resolved against the site root, like the links collected before
+        root = urljoin(response.url, "/")
+        for endpoint in self.extract_links(soup):
+            self.all_urls.add(endpoint)
+            url = urljoin(root, endpoint)
+            if self.single_pass:
+                yield Request(url, callback=self.parse, meta={"parse_unchanged": True})
+            else:
+                # the content request repeats the discovery url, so it skips the dupefilter
+                yield Request(url, callback=self.parse, dont_filter=True)
+                yield Request(url, callback=self.discover, meta={"parse_unchanged": True})
+
+    def make_soup(self, text: str) -> BeautifulSoup:
+        return make_soup(text, getattr(self, "parser", DEFAULT_PARSER), FACULTY_STRAINER)
+
+    def closed(self, reason: str) -> None:
+        stats = self.crawler.stats
+        requests = stats.get_value("downloader/request_count", 0)
+        response_bytes = stats.get_value("downloader/response_bytes", 0)
+        pages = stats.get_value("item_scraped_count", 0)
+        self.logger.info(
+            f"{'single' if self.single_pass else 'two'} pass crawl: {pages} pages, {requests} requests, "
+            f"{response_bytes / 1e6:.2f} MB downloaded ({response_bytes / max(pages, 1) / 1e3:.1f} KB per page)"
+        )
+
+    def extract_links(self, soup: BeautifulSoup) -> Set[str]:
+        # skip header container if already visited
+        header_container = soup.find('div', id='headercontainer')
+        if header_container and self.is_header_crawled:
+            header_container.decompose()
+        elif header_container:
+            self.is_header_crawled = True
+
+        urls = set()
+        # find all endpoints in the page
+        for a_tag in soup.find_all('a', href=True):
+            if isinstance(a_tag, Tag):
+                href = a_tag.get('href')
+                if href and self.is_valid_url(str(href)) \
+                    and href not in self.all_urls:
+                    # add trailing slash if not present and no file extension
+                    normalized_href = str(href)
+                    if '.' not in normalized_href.split('/')[-1]:
+                        normalized_href = normalized_href.rstrip('/') + '/'
+                    
+                    if normalized_href not in self.all_urls:
+                        urls.add(normalized_href)
+        return urls
 
-    def get_all_urls(self) -> Set[str]:
-        base_url = f'https://{self.base_url}'
-        # add trailing slash if not present
-        if not base_url.endswith('/'):
-            base_url += '/'
-
-        # get all urls from the base url
-        urls = set(self.get_all_urls_from_url(base_url))
-        self.all_urls.update(urls)
-        visited_endpoints: Set[str] = set()
-
-        while urls:
-            endpoint = urls.pop()
-            if endpoint in visited_endpoints:
-                continue
-            visited_endpoints.add(endpoint)
-            target_url = urljoin(base_url, endpoint)
-            # print(target_url)
-            res = self.get_all_urls_from_url(target_url)
-
-            urls.update(res)
-            self.all_urls.update(res)
-
-        return self.all_urls
-
-    def get_all_urls_from_url(self, target_url: str) -> Set[str]:
-        if not target_url.endswith('/'):
-            target_url += '/'
-
-        urls = []
-        # get all urls from the base url
-        with httpx.Client() as client:
-            response = client.get(target_url)
-            soup = BeautifulSoup(response.text, 'html.parser')
-
-            # skip header container if already visited
-            header_container = soup.find('div', id='headercontainer')
-            if header_container and self.is_header_crawled:
-                header_container.decompose()
-            elif header_container:
-                self.is_header_crawled = True
-
-            # find all endpoints in the page
-            for a_tag in soup.find_all('a', href=True):
-                if isinstance(a_tag, Tag):
-                    href = a_tag.get('href')
-                    if href and self.is_valid_url(str(href)) \
-                        and href not in self.all_urls:
-                        # add trailing slash if not present and no file extension
-                        normalized_href = str(href)
-                        if '.' not in normalized_href.split('/')[-1]:
-                            normalized_href = normalized_href.rstrip('/') + '/'
-                        
-                        if normalized_href not in self.all_urls:
-                            urls.append(normalized_href)
-        return set(urls)
-
-    def fetch_content(self, text: str, url: str) -> Dict[str, Any]:
-        soup = BeautifulSoup(text, 'html.parser')
+    def fetch_content(self, text: str | BeautifulSoup, url: str) -> Dict[str, Any]:
+        soup = text if isinstance(text, BeautifulSoup) else self.make_soup(text)
 
         main_content = soup.find_all('div', class_='panel')
 
@@ -102,45 +143,44 @@ class CSFacultySpider(Spider):
             print(f"No main content found for {url}")
             return {}
         
-        content_dict: Dict[str, str] = {}
-        # print(main_content)
+        # title -> section texts, joined once at the end instead of growing strings
+        sections: Dict[str, List[str]] = {}
 
         for panel in main_content:
             # dictionary to store title-content pairs
             if isinstance(panel, Tag):
-                # find all headers (h1-h6)
-                headers = panel.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
-                
-                for _, header in enumerate(headers):
-                    title = self.clean_text(header.get_text().strip())
-                    content = []
-                    
-                    # get all elements between this header and the next one
-                    current = header.next_sibling
-                    while current and (
-                        not isinstance(current, Tag) 
-                        or current.name not in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']):
-
-                        if current is None:
-                            break
-                        if isinstance(current, (Tag, str)) and str(current).strip():
-                            content.append(current.get_text().strip() if isinstance(current, Tag) else str(current).strip())
-                        current = current.next_sibling
-
-                    # print(f"title: {title}")
-                    # print(f"content: {content}")
-                    
+                for title, content in self.segment_panel(panel):
                     if title:  # only add if title is not empty
-                        # if classify(title)[0] != 'en':
-                        #     print(f"title: {title} is not in english, its in {classify(title)}")
-                            # continue
-                        if content_dict.get(title):
-                            content_dict[title] += '\n' + '\n'.join(filter(None, content))
+                        text = '\n'.join(content)
+                        # a title that only had empty sections so far is replaced, otherwise appended
+                        if sections.get(title, [''])[0]:
+                            sections[title].append(text)
                         else:
-                            content_dict[title] = '\n'.join(filter(None, content))
+                            sections[title] = [text]
 
+        content_dict = {title: '\n'.join(texts) for title, texts in sections.items()}
         return content_dict
 
+    def segment_panel(self, panel: Tag) -> List[Tuple[str, List[str]]]:
+        # one section per header in document order, holding the text of the siblings after it up
+        # to the next header. each parent of a header walks its children once, so nested headers
+        # are not re-walked
+        headers = panel.find_all(HEADERS)
+        sections = {id(header): (self.clean_text(header.get_text().strip()), []) for header in headers}
+        parents = {id(header.parent): header.parent for header in headers}
+
+        for parent in parents.values():
+            content = None
+            for child in parent.children:
+                if isinstance(child, Tag) and child.name in HEADERS:
+                    content = sections[id(child)][1]
+                elif content is not None:
+                    text = child.get_text().strip() if isinstance(child, Tag) else str(child).strip()
+                    if text:
+                        content.append(text)
+
+        return [sections[id(header)] for header in headers]
+
     def is_valid_url(self, url: str) -> bool:
         parsed = urlparse(url)
         exclude_paths = [
@@ -4,8 +4,8 @@ from scrapy.http import Request
 from scrapy.http import Response
 from typing import Any, Dict, List
 from dotenv import load_dotenv
-from pymongo import MongoClient
-from bs4 import BeautifulSoup
+from database.mongo import mongo_client
+from ecalendar.parsers import make_soup, spider_parser, DEFAULT_PARSER, PROGRAM_STRAINER
 import json
 import os
 load_dotenv()
@@ -20,8 +20,9 @@ class ProgramsMetaSpider(Spider):
         self.start_urls = [ self.domain + "/study/" + self.year + "/programs/search?page=0" ]
 
     def start_requests(self) -> Iterable[Request]:
+        # unchanged search pages are still parsed to reach the next page, their items are dropped
         for url in self.start_urls:
-            yield Request(url, callback=self.parse)
+            yield Request(url, callback=self.parse, meta={"parse_unchanged": True})
 
     def parse(self, response: Response, **kwargs: Any) -> Any:
         # self.log(response.url)
@@ -49,7 +50,7 @@ class ProgramsMetaSpider(Spider):
         next_page = response.css("li.pager-next a::attr(href)").get()
         # self.log(f"Next page: {next_page}")
         if next_page:
-            yield Request(self.domain + next_page, callback=self.parse)
+            yield Request(self.domain + next_page, callback=self.parse, meta={"parse_unchanged": True})
 
 
 class ProgramsSpider(Spider):
@@ -60,11 +61,12 @@ class ProgramsSpider(Spider):
         self.year = os.getenv("YEAR")
 
     def start_requests(self) -> Iterable[Request]:
-        client = MongoClient(os.getenv("MONGODB_URI"))
-        db = client[os.getenv("MONGODB_DATABASE_NAME")]
-        collection = db["programs" + "_" + self.year.replace("-", "_")]
+        self.parser = spider_parser(self)
+        with mongo_client() as client:
+            db = client[os.getenv("MONGODB_DATABASE_NAME")]
+            collection = db["programs" + "_" + self.year.replace("-", "_")]
 
-        urls = [program["url"] for program in collection.find()]
+            urls = [program["url"] for program in collection.find()]
         # self.log(f"Found {len(urls)} programs")
         
         for url in []:
@@ -72,7 +74,7 @@ class ProgramsSpider(Spider):
 
     def parse(self, response: Response, **kwargs: Any) -> Any:
         # Use BeautifulSoup to get direct children more reliably
-        soup = BeautifulSoup(response.text, 'html.parser')
+        soup = make_soup(response.text, getattr(self, "parser", DEFAULT_PARSER), PROGRAM_STRAINER)
         content_div = soup.select_one("div.node-program div.content")
         
         # Get direct children only
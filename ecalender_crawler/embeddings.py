@@ -0,0 +1,310 @@
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+from pymongo.operations import SearchIndexModel
+from database.embbedings import (
+    encode_batched, 
+    generate_bson_vector, 
+    bson_vector_to_array, 
+    embedding_cache_stats, 
+    encode_text,
+    rescore,
+    quantize, 
+    EMBEDDING_BATCH_SIZE, 
+    PRECISION_DTYPES,
+    MODEL_NAME,
+    MAX_LENGTH
+)
+from database.chroma import get_client
+from database.bulk_writer import BulkWriteBuffer
+from concurrent.futures import Future, ThreadPoolExecutor
+from database.enums import ChromaCollection
+from typing import Any, Callable, Iterable, Iterator, List, Mapping, Sequence
+from tqdm import tqdm
+import numpy as np
+import hashlib
+import time
+import os
+
+# number of documents read from the cursor before encoding them together, each chunk is one bulk write
+EMBEDDING_CHUNK_SIZE = int(os.getenv("EMBEDDING_CHUNK_SIZE", "512"))
+EMBEDDING_CHECKPOINT_COLLECTION = os.getenv("EMBEDDING_CHECKPOINT_COLLECTION", "embedding_checkpoints")
+
+# atlas only supports euclidean similarity on packed bit vectors
+VECTOR_SIMILARITY = {
+    "float32": "dotProduct",
+    "int8": "dotProduct",
+    "ubinary": "euclidean",
+}
+
+def document_text(document: Mapping[str, Any]) -> str:
+    return f"{document['name']}\n{document['overview']}"
+
+# stored next to the vector, a document is re-encoded when either one changes. the full precision
+# copy is part of it so turning keep_float32 on or off also rewrites the documents
+def embedding_model_id(precision: str = "float32", keep_float32: bool = False) -> str:
+    model_id = f"{MODEL_NAME}:{MAX_LENGTH}:{precision}"
+    return f"{model_id}+float32" if keep_float32 and precision != "float32" else model_id
+
+def text_fingerprint(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def is_stale(document: Mapping[str, Any], fingerprint_field: str, model_field: str, model_id: str) -> bool:
+    return document.get(model_field) != model_id \
+        or document.get(fingerprint_field) != text_fingerprint(document_text(document))
+
+def stale_filter(fingerprint_field: str, model_field: str, model_id: str) -> Mapping[str, Any]:
+    # the part of is_stale mongo can evaluate, text changes need the fingerprint computed here
+    return {"$or": [{model_field: {"$ne": model_id}}, {fingerprint_field: {"$exists": False}}]}
+
+def iter_chunks(documents: Iterable[Mapping[str, Any]], size: int) -> Iterator[List[Mapping[str, Any]]]:
+    chunk: List[Mapping[str, Any]] = []
+    for document in documents:
+        chunk.append(document)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# the last _id written by an interrupted refresh, keyed by collection and field
+def checkpoints(collection: Collection) -> Collection:
+    return collection.database[EMBEDDING_CHECKPOINT_COLLECTION]
+
+def load_checkpoint(collection: Collection, embedding_field: str, run: Mapping[str, Any]) -> Any:
+    checkpoint = checkpoints(collection).find_one({"_id": f"{collection.name}.{embedding_field}"})
+    # a checkpoint left by a run with another model or mode does not cover this one
+    if checkpoint is None or checkpoint["run"] != run:
+        return None
+    return checkpoint["last_id"]
+
+def save_checkpoint(collection: Collection, embedding_field: str, run: Mapping[str, Any], last_id: Any) -> None:
+    checkpoints(collection).replace_one(
+        {"_id": f"{collection.name}.{embedding_field}"},
+        {"run": run, "last_id": last_id},
+        upsert=True
+    )
+
+def clear_checkpoint(collection: Collection, embedding_field: str) -> None:
+    checkpoints(collection).delete_one({"_id": f"{collection.name}.{embedding_field}"})
+
+def embed_documents(collection: Collection, 
+                    document_filter: Mapping[str, Any], 
+                    embedding_field: str,
+                    batch_size: int = EMBEDDING_BATCH_SIZE,
+                    chunk_size: int = EMBEDDING_CHUNK_SIZE,
+                    precision: str = "float32",
+                    keep_float32: bool = False,
+                    full: bool = False,
+                    compare_text: bool = True) -> int:
+    # encodes the documents in _id order and writes every chunk while the next one is encoded,
+    # checkpointing the last written _id so an interrupted refresh resumes after it.
+    # documents embedded by another model or never embedded are selected by the query. finding
+    # the ones whose text changed means streaming every document and comparing fingerprints,
+    # compare_text=False skips that and only reads what the query selects
+    fingerprint_field = f"{embedding_field}_fingerprint"
+    model_field = f"{embedding_field}_model"
+    model_id = embedding_model_id(precision, keep_float32)
+    run = {"model": model_id, "full": full, "keep_float32": keep_float32, "compare_text": compare_text}
+
+    if not full and not compare_text:
+        document_filter = {"$and": [document_filter, stale_filter(fingerprint_field, model_field, model_id)]}
+
+    last_id = load_checkpoint(collection, embedding_field, run)
+    if last_id is not None:
+        print(f"Resuming after {last_id}")
+        document_filter = {"$and": [document_filter, {"_id": {"$gt": last_id}}]}
+
+    projection = {"_id": 1, "overview": 1, "name": 1, fingerprint_field: 1, model_field: 1}
+    documents = collection.find(document_filter, projection).sort("_id", 1)
+    writes = BulkWriteBuffer(collection)
+
+    def write(operations: List[UpdateOne], last_id: Any) -> None:
+        failed = writes.failed
+        writes.write(operations)
+        if writes.failed > failed:
+            raise RuntimeError(f"{writes.failed - failed} embedding updates failed, resume from {last_id}")
+        save_checkpoint(collection, embedding_field, run, last_id)
+
+    with tqdm(total=collection.count_documents(document_filter)) as progress, \
+         ThreadPoolExecutor(max_workers=1) as executor:
+        def scan() -> Iterator[Mapping[str, Any]]:
+            for document in documents:
+                progress.update(1)
+                if full or not compare_text or is_stale(document, fingerprint_field, model_field, model_id):
+                    yield document
+
+        pending: Future[None] | None = None
+        for chunk in iter_chunks(scan(), chunk_size):
+            texts = [document_text(doc) for doc in chunk]
+            vectors = encode_batched(texts, batch_size=batch_size).cpu().numpy()
+            quantized = quantize(vectors, precision)
+
+            operations = []
+            for doc, text, vector, quantized_vector in zip(chunk, texts, vectors, quantized):
+                fields = { 
+                    embedding_field: generate_bson_vector(quantized_vector, PRECISION_DTYPES[precision]),
+                    fingerprint_field: text_fingerprint(text),
+                    model_field: model_id,
+                }
+                # full precision copy used to rescore candidates found with the quantized index
+                if keep_float32 and precision != "float32":
+                    fields[f"{embedding_field}_float32"] = generate_bson_vector(vector)
+                    update = {"$set": fields}
+                else:
+                    # a copy left by an earlier run would rescore with the old vector
+                    update = {"$set": fields, "$unset": {f"{embedding_field}_float32": ""}}
+                operations.append(UpdateOne({"_id": doc["_id"]}, update))
+
+            # keep one write in flight so the checkpoints stay in _id order
+            if pending is not None:
+                pending.result()
+            pending = executor.submit(write, operations, chunk[-1]["_id"])
+
+        if pending is not None:
+            pending.result()
+
+    clear_checkpoint(collection, embedding_field)
+
+    print(f"Encoded {writes.written} documents: {writes.stats()}")
+    if stats := embedding_cache_stats():
+        print(f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses")
+
+    return writes.written
+
+def ensure_vector_index(collection: Collection, 
+                        embedding_field: str, 
+                        precision: str = "float32",
+                        name: str = "vector_index",
+                        rebuild: bool = False) -> None:
+    # atlas keeps the index in sync with document updates, so it is only rebuilt when its definition changes
+    definition = {
+        "fields": [
+            {
+                "type": "vector",
+                "path": embedding_field, 
+                "similarity": VECTOR_SIMILARITY[precision], # https://www.pinecone.io/learn/vector-similarity/
+                "numDimensions": 1024 # dimension specified here: https://huggingface.co/BAAI/bge-m3
+            }
+        ]
+    }
+
+    existing = next(iter(collection.list_search_indexes(name)), None)
+    if existing is not None:
+        if not rebuild and existing.get("latestDefinition") == definition:
+            return
+        collection.drop_search_index(name)
+
+    collection.create_search_index(model=SearchIndexModel(definition=definition, name=name, type="vectorSearch"))
+
+def vector_search(collection: Collection,
+                  query: str,
+                  k: int = 10,
+                  precision: str = "float32",
+                  embedding_field: str = "embeddings",
+                  index: str = "vector_index",
+                  rescore_factor: int = 4,
+                  projection: Mapping[str, Any] | None = None) -> List[Mapping[str, Any]]:
+    # $vectorSearch over the (possibly quantized) index. with a quantized index, k * rescore_factor
+    # candidates are fetched and reranked by their float32 copies (update_*_embeddings keep_float32=True)
+    float32_field = f"{embedding_field}_float32"
+    query_vector = encode_text(query).cpu().numpy()
+    rescored = precision != "float32"
+    limit = k * rescore_factor if rescored else k
+
+    pipeline: List[Mapping[str, Any]] = [
+        {
+            "$vectorSearch": {
+                "index": index,
+                "path": embedding_field,
+                "queryVector": generate_bson_vector(quantize(query_vector, precision), PRECISION_DTYPES[precision]),
+                "numCandidates": limit * 10,
+                "limit": limit,
+            }
+        },
+        {"$project": {**(projection or {"name": 1, "overview": 1, "url": 1}), float32_field: 1, "score": {"$meta": "vectorSearchScore"}}},
+    ]
+    documents = list(collection.aggregate(pipeline))
+    if rescored and documents and all(float32_field in doc for doc in documents):
+        documents = [documents[i] for i in rescore(query_vector, [doc[float32_field] for doc in documents], k)]
+
+    for doc in documents:
+        doc.pop(float32_field, None)
+    return documents[:k]
+
+def export_to_chroma(collection: Collection,
+                     chroma_collection: ChromaCollection,
+                     document_filter: Mapping[str, Any],
+                     id_field: str,
+                     embedding_field: str = "embeddings",
+                     metadata_fields: Sequence[str] = ("id", "url", "name", "faculty", "department", "level"),
+                     text_fields: Sequence[str] = ("name", "overview"),
+                     text_fn: Callable[[Mapping[str, Any]], str] = document_text) -> None:
+    # load documents into chroma with the vectors already stored in mongo instead of re-encoding them.
+    # metadata_fields are written as chroma metadata so queries can filter on them.
+    # chroma ids come from id_field, which survives a rebuilt collection unlike _id, so a re-export
+    # upserts in place and documents no longer in mongo are deleted from chroma
+    client = get_client()
+    if client is None:
+        raise ValueError("Chroma is disabled (QUERY_ONLY_LOCAL=1)")
+
+    float32_field = f"{embedding_field}_float32"
+    projection = {field: 1 for field in [id_field, *text_fields, embedding_field, float32_field, *metadata_fields]}
+
+    ids, documents, metadata, embeddings = [], [], [], []
+    for doc in collection.find(document_filter, projection):
+        # quantized vectors cannot be ingested, prefer the full precision copy when there is one
+        vector = bson_vector_to_array(doc.get(float32_field, doc[embedding_field]))
+        if vector.dtype != np.float32:
+            raise ValueError(f"{doc['_id']} has no float32 vector in {embedding_field} or {float32_field}")
+
+        ids.append(str(doc[id_field]))
+        documents.append(text_fn(doc))
+        # chroma rejects None metadata values
+        metadata.append({field: doc[field] for field in metadata_fields if doc.get(field) is not None})
+        embeddings.append(vector)
+
+    existing = client.call(lambda: client.get_collection(chroma_collection, create=True).get(include=[])["ids"])
+    client.add_documents(chroma_collection, documents, metadata, ids, embeddings=np.stack(embeddings) if embeddings else None)
+
+    removed = sorted(set(existing) - set(ids))
+    if removed:
+        client.delete_documents(chroma_collection, removed)
+    print(f"Exported {len(ids)} documents to chroma collection {chroma_collection.value}, deleted {len(removed)}")
+
+def benchmark_quantization(collection: Collection, 
+                           embedding_field: str = "embeddings", 
+                           n_queries: int = 200, 
+                           k: int = 10,
+                           rescore_factor: int = 4) -> None:
+    # recall@k of each precision against exact float32 search, using the stored vectors as the corpus
+    documents = collection.find({embedding_field: {"$exists": True}}, {embedding_field: 1})
+    corpus = np.stack([bson_vector_to_array(doc[embedding_field]) for doc in documents]).astype(np.float32)
+
+    rng = np.random.default_rng(0)
+    queries = corpus[rng.choice(len(corpus), size=min(n_queries, len(corpus)), replace=False)]
+    exact = np.argsort(-(queries @ corpus.T), axis=1)[:, :k]
+
+    print(f"{'precision':<10}{'bytes':>8}{'recall':>10}{'rescored':>10}{'ms/query':>10}")
+    for precision in PRECISION_DTYPES:
+        quantized_corpus = quantize(corpus, precision)
+        quantized_queries = quantize(queries, precision)
+
+        start = time.perf_counter()
+        if precision == "ubinary":
+            # hamming distance between packed sign bits
+            scores = np.stack([
+                -np.unpackbits(np.bitwise_xor(quantized_corpus, query), axis=1).sum(axis=1)
+                for query in quantized_queries
+            ])
+        else:
+            scores = quantized_queries.astype(np.int32 if precision == "int8" else np.float32) \
+                @ quantized_corpus.astype(np.int32 if precision == "int8" else np.float32).T
+        candidates = np.argsort(-scores, axis=1, kind="stable")[:, :k * rescore_factor]
+        elapsed = (time.perf_counter() - start) * 1000 / len(queries)
+
+        recall = np.mean([len(set(candidates[i, :k]) & set(exact[i])) / k for i in range(len(queries))])
+        rescored = np.mean([
+            len(set(candidates[i][rescore(queries[i], corpus[candidates[i]], k)]) & set(exact[i])) / k
+            for i in range(len(queries))
+        ])
+        print(f"{precision:<10}{quantized_corpus.shape[1] * quantized_corpus.itemsize:>8}{recall:>10.3f}{rescored:>10.3f}{elapsed:>10.2f}")
@@ -0,0 +1,25 @@
+from database.mongo import get_mongo_client, mongo_job
+from database.enums import ChromaCollection
+from ecalender_crawler.embeddings import export_to_chroma
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+# bulk load the faculty page chunks written by MongoDBFacultyPipeline into chroma,
+# keeping their url and tags as filterable metadata
+@mongo_job
+def export_faculty_to_chroma():
+    client = get_mongo_client()
+    db = client[os.getenv("MONGODB_DATABASE_NAME")]
+    collection = db["general_" + os.getenv("YEAR").replace("-", "_")]
+
+    export_to_chroma(
+        collection, 
+        ChromaCollection.Faculty, 
+        { 'embeddings': { '$exists': True } },
+        "id",
+        metadata_fields=("url", "tags"),
+        text_fields=("content",),
+        text_fn=lambda doc: doc["content"]
+    )
@@ -1,69 +1,50 @@
-from pymongo import MongoClient, UpdateOne
-from pymongo.operations import SearchIndexModel
-from bson.binary import Binary, BinaryVectorDtype
+from database.mongo import get_mongo_client, mongo_job
+from database.enums import ChromaCollection
 from dotenv import load_dotenv
 import os
-from tqdm import tqdm
-from database.embbedings import encode_text
+from database.embbedings import EMBEDDING_BATCH_SIZE
+from ecalender_crawler.embeddings import embed_documents, ensure_vector_index, export_to_chroma
 
 load_dotenv()
 
-# Generate BSON vector using `BinaryVectorDtype`
-def generate_bson_vector(vector, vector_dtype):
-    return Binary.from_vector(vector, vector_dtype)
-
 # https://www.mongodb.com/docs/atlas/atlas-vector-search/create-embeddings/
 # only create vector index for overview field
-def update_program_embeddings():
-    client = MongoClient(os.getenv("MONGODB_URI"))
+@mongo_job
+def update_program_embeddings(batch_size: int = EMBEDDING_BATCH_SIZE, 
+                              precision: str = "float32", 
+                              keep_float32: bool = False,
+                              full: bool = False,
+                              compare_text: bool = True):
+    client = get_mongo_client()
     db = client[os.getenv("MONGODB_DATABASE_NAME")]
     collection = db["programs_2024_2025"]
 
     # json schema
     overview_filter = { '$and': [ { 'overview': { '$exists': True, '$ne': None } } ] }
 
-    # get courses with overview
-    programs = collection.find(overview_filter, {"_id": 1, "overview": 1, "name": 1})
-
     embedding_field = "embeddings"
-    
-    operations = []
-    for program in tqdm(programs, total=collection.count_documents(overview_filter)):
-        overview = program["overview"]
-        name = program["name"]
-        text = f"{name}\n{overview}"
-        
-        # generate embeddings for precision float32
-        vector = encode_text([text]).tolist()[0]
-        vector_bson_float32 = generate_bson_vector(vector, BinaryVectorDtype.FLOAT32)
+    updated = embed_documents(collection, overview_filter, embedding_field, 
+                              batch_size=batch_size, precision=precision, keep_float32=keep_float32, full=full,
+                              compare_text=compare_text)
 
-        operations.append(UpdateOne({"_id": program["_id"]}, {"$set": {embedding_field: vector_bson_float32}}))
+    print(f"Updated {updated} programs") # about ~10000 courses
 
-    if operations:
-        result = collection.bulk_write(operations)
-        print(f"Updated {result.modified_count} programs") # about ~10000 courses
+    ensure_vector_index(collection, embedding_field, precision, rebuild=full)
 
-    drop_index("vector_index")
-    # create index
-    search_index_model = SearchIndexModel(
-        definition = {
-            "fields": [
-                {
-                    "type": "vector",
-                    "path": embedding_field, 
-                    "similarity": "dotProduct", # https://www.pinecone.io/learn/vector-similarity/
-                    "numDimensions": 1024 # dimension specified here: https://huggingface.co/BAAI/bge-m3
-                }
-            ]
-        },
-        name="vector_index",
-        type="vectorSearch",
-    )
-    collection.create_search_index(model=search_index_model)
+# bulk load the stored program embeddings into chroma
+@mongo_job
+def export_programs_to_chroma():
+    client = get_mongo_client()
+    db = client[os.getenv("MONGODB_DATABASE_NAME")]
+    collection = db["programs_2024_2025"]
+
+    overview_filter = { 'embeddings': { '$exists': True } }
+    export_to_chroma(collection, ChromaCollection.Program, overview_filter, "url")
 
 # the search index, not vector index
+@mongo_job
 def update_courses_atlas_index():
-    client = MongoClient(os.getenv("MONGODB_URI"))
+    client = get_mongo_client()
     db = client[os.getenv("MONGODB_DATABASE_NAME")]
     collection = db[os.getenv("MONGODB_COLLECTION_NAME")]
 
@@ -120,8 +101,9 @@ def update_courses_atlas_index():
     collection.create_search_index(index)
 
 
+@mongo_job
 def drop_index(name: str):
-    client = MongoClient(os.getenv("MONGODB_URI"))
+    client = get_mongo_client()
     db = client[os.getenv("MONGODB_DATABASE_NAME")]
     collection = db[os.getenv("MONGODB_COLLECTION_NAME")]
 
@@ -130,8 +112,9 @@ def drop_index(name: str):
     except Exception as e:
         print(f"Error dropping index: {e}")
 
+@mongo_job
 def delete_document_fields(field: str):
-    client = MongoClient(os.getenv("MONGODB_URI"))
+    client = get_mongo_client()
     db = client[os.getenv("MONGODB_DATABASE_NAME")]
     collection = db[os.getenv("MONGODB_COLLECTION_NAME")]
 
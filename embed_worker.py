@@ -0,0 +1,65 @@
+from pymongo import UpdateOne
+from database.mongo import acquire_mongo_client, release_mongo_client
+from database.embedding_queue import get_embedding_queue
+from database.embbedings import encode_batched, generate_bson_vector
+from collections import defaultdict
+from dotenv import load_dotenv
+from typing import Dict, List
+import time
+import sys
+import os
+
+load_dotenv()
+
+# number of queued texts encoded and written back together
+EMBED_WORKER_BATCH_SIZE = int(os.getenv("EMBED_WORKER_BATCH_SIZE", "256"))
+EMBED_WORKER_POLL_SECONDS = float(os.getenv("EMBED_WORKER_POLL_SECONDS", "5"))
+
+def embed_worker(once: bool = False) -> None:
+    queue = get_embedding_queue()
+    client = acquire_mongo_client()
+    db = client[os.getenv("MONGODB_DATABASE_NAME")]
+
+    processed = 0
+    try:
+        while True:
+            jobs = queue.lease(EMBED_WORKER_BATCH_SIZE)
+            if not jobs:
+                if once:
+                    break
+                time.sleep(EMBED_WORKER_POLL_SECONDS)
+                continue
+
+            try:
+                vectors = encode_batched([job.text for job in jobs]).cpu().numpy()
+
+                operations: Dict[str, List[UpdateOne]] = defaultdict(list)
+                for job, vector in zip(jobs, vectors):
+                    operations[job.collection].append(
+                        UpdateOne({job.id_field: job.doc_id}, {"$set": {job.field: generate_bson_vector(vector)}})
+                    )
+                # the updates are idempotent, so a batch replayed after a crash is harmless
+                for collection_name, collection_operations in operations.items():
+                    db[collection_name].bulk_write(collection_operations, ordered=False)
+            except Exception:
+                queue.release(jobs)
+                raise
+
+            queue.ack(jobs)
+            processed += len(jobs)
+            print(f"Embedded {processed} documents, {len(queue)} queued")
+    finally:
+        release_mongo_client()
+        queue.close()
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+
+    if args not in ([], ["--once"]):
+        print("Usage: python embed_worker.py [--once]")
+        sys.exit(1)
+
+    try:
+        embed_worker(once=args == ["--once"])
+    except KeyboardInterrupt:
+        print("\nEmbedding interrupted by user. Shutting down...")
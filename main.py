@@ -1,19 +1,25 @@
 from faculty_crawlers.crawler import CoursePlannerCrawler
-from database.chroma import client
+from database.chroma import get_client
 from ecalender_crawler.courses import update_course_embeddings, update_courses_atlas_index
 from ecalender_crawler.programs import update_program_embeddings
+import sys
 
 def main() -> None:
+    # --full re-encodes every document instead of only the ones whose text or model changed
+    full = "--full" in sys.argv[1:]
+    # --no-text-check only encodes documents that are new or were embedded by another model,
+    # without streaming the whole collection to look for changed texts
+    compare_text = "--no-text-check" not in sys.argv[1:]
     # crawler = CoursePlannerCrawler()
     try:
         # crawler.crawl_all()
-        # print(client.heartbeat())
+        # print(get_client().heartbeat())
         # update_course_embeddings()
         # delete_document_fields("BSON-Float32-Embedding")
         # update_course_embeddings()
-        update_course_embeddings()
+        update_course_embeddings(full=full, compare_text=compare_text)
         # update_courses_atlas_index()
-        # update_program_embeddings()
+        # update_program_embeddings(full=full, compare_text=compare_text)
     except KeyboardInterrupt:
         print("\nCrawling interrupted by user. Shutting down...")
     except Exception as e:
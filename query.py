@@ -1,11 +1,11 @@
-from database.chroma import client
+from database.chroma import get_client
 from database.enums import ChromaCollection
 import json
 import sys
 
 def query(query: str, n_results: int = 5) -> None:
     try:
-        results = client.query(ChromaCollection.Faculty, query=query, n_results=n_results)
+        results = get_client().query(ChromaCollection.Faculty, query=query, n_results=n_results)
         print(json.dumps(results, indent=4))
     except KeyboardInterrupt:
         print("\nCrawling interrupted by user. Shutting down...")
@@ -1,24 +1,180 @@
-from fastapi import FastAPI
-from database.chroma import client
+from fastapi import Depends, FastAPI, Header, HTTPException, Response
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from database.chroma import ChromaClient, build_where, close_client, get_client, split_query_result
+from chromadb.errors import InvalidCollectionException
+from chromadb.api.types import Where, WhereDocument
+from database.batcher import EncodeBatcher
 from database.enums import ChromaCollection
 from pydantic import BaseModel
-from pipelines.embedding_encoder import encode_text
+from database.embbedings import encode_text, quantize, warmup
+from typing import AsyncIterator, Callable, Literal, TypeVar
+import numpy as np
+import asyncio
+import io
+import os
 
-app = FastAPI(title="Course Planner Query API", description="Query the Course Planner database")
+T = TypeVar("T")
+
+# encoding is CPU bound and gets its own small pool, chroma calls are I/O bound and share
+# the client's pooled http session; requests beyond QUERY_API_MAX_IN_FLIGHT are rejected with 503
+QUERY_API_ENCODE_WORKERS = int(os.getenv("QUERY_API_ENCODE_WORKERS", "1"))
+QUERY_API_CHROMA_WORKERS = int(os.getenv("QUERY_API_CHROMA_WORKERS", "8"))
+QUERY_API_MAX_IN_FLIGHT = int(os.getenv("QUERY_API_MAX_IN_FLIGHT", "64"))
+
+encode_executor = ThreadPoolExecutor(max_workers=QUERY_API_ENCODE_WORKERS, thread_name_prefix="encode")
+chroma_executor = ThreadPoolExecutor(max_workers=QUERY_API_CHROMA_WORKERS, thread_name_prefix="chroma")
+in_flight = 0
+
+# concurrent /api/encode/ and query encodes are coalesced into shared forward passes
+batcher = EncodeBatcher(
+    lambda texts: encode_text(texts, cache=False).cpu().numpy(),
+    encode_executor,
+    max_wait_ms=float(os.getenv("ENCODE_BATCH_MAX_WAIT_MS", "5")),
+    max_batch_size=int(os.getenv("ENCODE_BATCH_MAX_SIZE", "64")),
+    workers=QUERY_API_ENCODE_WORKERS,
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # load the model and connect to chroma before serving the first request
+    if os.getenv("QUERY_API_WARMUP", "1") == "1":
+        warmup()
+        get_client()
+    yield
+    encode_executor.shutdown(wait=False, cancel_futures=True)
+    chroma_executor.shutdown(wait=False, cancel_futures=True)
+    close_client()
+
+app = FastAPI(title="Course Planner Query API", description="Query the Course Planner database", lifespan=lifespan)
+
+async def run_in(executor: ThreadPoolExecutor, function: Callable[[], T]) -> T:
+    return await asyncio.get_running_loop().run_in_executor(executor, function)
+
+async def limit_in_flight() -> AsyncIterator[None]:
+    # all handlers run on the event loop thread, so a plain counter is enough
+    global in_flight
+    if in_flight >= QUERY_API_MAX_IN_FLIGHT:
+        raise HTTPException(status_code=503, detail="Server busy, retry later", headers={"Retry-After": "1"})
+    in_flight += 1
+    try:
+        yield
+    finally:
+        in_flight -= 1
+
+async def chroma_client() -> ChromaClient:
+    # the first call connects with a blocking heartbeat, so it runs off the event loop
+    client = await run_in(chroma_executor, get_client)
+    if client is None:
+        raise HTTPException(status_code=503, detail="Chroma is disabled (QUERY_ONLY_LOCAL=1)")
+    return client
+
+class QueryFilters(BaseModel):
+    # metadata written by the ingestion path, compiled to a chroma where clause
+    faculty: str | None = None
+    department: str | None = None
+    level: str | None = None
+    url: str | None = None
+    tags: str | None = None
+    # only match documents containing this text
+    contains: str | None = None
+
+    def where(self) -> Where | None:
+        # course levels are stored as integers, program levels as names
+        level = int(self.level) if self.level is not None and self.level.isdigit() else self.level
+        return build_where(faculty=self.faculty, department=self.department, level=level, 
+                           url=self.url, tags=self.tags)
+
+    def where_document(self) -> WhereDocument | None:
+        return {"$contains": self.contains} if self.contains else None
+
+async def run_query(queries: list[str], n_results: int, collection: ChromaCollection, filters: QueryFilters):
+    client = await chroma_client()
+
+    embeddings = client.cached_query_embeddings(queries)
+    missing = list(dict.fromkeys(query for query in queries if query not in embeddings))
+    if missing:
+        encoded = dict(zip(missing, await batcher.encode(missing)))
+        client.cache_query_embeddings(encoded)
+        embeddings.update(encoded)
+    query_embeddings = np.stack([embeddings[query] for query in queries])
+
+    try:
+        return await run_in(chroma_executor, lambda: client.query_many(
+            collection, queries, n_results=n_results, query_embeddings=query_embeddings,
+            where=filters.where(), where_document=filters.where_document()
+        ))
+    except InvalidCollectionException:
+        raise HTTPException(status_code=404, detail=f"Collection {collection.value} does not exist")
 
 @app.get("/")
 async def root():
     return {"message": "Hello World"}
 
-@app.get("/api/query/")
-async def query(query: str, n_results: int = 10):
-    results = client.query(ChromaCollection.Faculty, query=query, n_results=n_results)
+@app.get("/api/query/", dependencies=[Depends(limit_in_flight)])
+async def query(query: str, 
+                n_results: int = 10, 
+                collection: ChromaCollection = ChromaCollection.Faculty,
+                filters: QueryFilters = Depends()):
+    results = await run_query([query], n_results, collection, filters)
     return results
 
+class BatchQueryRequest(BaseModel):
+    queries: list[str]
+    n_results: int = 10
+    collection: ChromaCollection = ChromaCollection.Faculty
+    filters: QueryFilters = QueryFilters()
+
+@app.post("/api/query/batch", dependencies=[Depends(limit_in_flight)])
+async def query_batch(request: BatchQueryRequest):
+    if not request.queries:
+        return []
+    results = await run_query(request.queries, request.n_results, request.collection, request.filters)
+    return split_query_result(results)
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    client = await chroma_client()
+    return client.cache_stats()
+
 class EncodeRequest(BaseModel):
     texts: list[str]
 
-@app.post("/api/encode/")
-async def encode(request: EncodeRequest):
-    results = encode_text(request.texts)
-    return results.tolist()
\ No newline at end of file
+# vectors can be sent back as json (default), raw little-endian bytes with the shape and dtype
+# in the X-Shape / X-Dtype headers (Accept: application/octet-stream) or a .npy file
+# (Accept: application/x-npy), as float32, float16 or scalar quantized int8
+BINARY_MEDIA_TYPE = "application/octet-stream"
+NPY_MEDIA_TYPE = "application/x-npy"
+ENCODE_DTYPES = {
+    "float32": np.dtype("<f4"),
+    "float16": np.dtype("<f2"),
+    "int8": np.dtype("i1"),
+}
+
+def serialize_vectors(vectors: np.ndarray, accept: str, dtype: str) -> Response | list:
+    vectors = quantize(vectors, "int8") if dtype == "int8" else vectors.astype(ENCODE_DTYPES[dtype])
+
+    if BINARY_MEDIA_TYPE in accept:
+        return Response(
+            content=vectors.tobytes(),
+            media_type=BINARY_MEDIA_TYPE,
+            headers={"X-Shape": ",".join(map(str, vectors.shape)), "X-Dtype": dtype}
+        )
+    if NPY_MEDIA_TYPE in accept:
+        buffer = io.BytesIO()
+        np.save(buffer, vectors, allow_pickle=False)
+        return Response(content=buffer.getvalue(), media_type=NPY_MEDIA_TYPE)
+    return vectors.tolist()
+
+@app.post("/api/encode/", dependencies=[Depends(limit_in_flight)])
+async def encode(request: EncodeRequest, 
+                 dtype: Literal["float32", "float16", "int8"] = "float32",
+                 accept: str = Header(default="application/json")):
+    if not request.texts:
+        return serialize_vectors(np.zeros((0, 0), dtype=np.float32), accept, dtype)
+    results = await batcher.encode(request.texts)
+    return serialize_vectors(results, accept, dtype)
+
+@app.get("/api/encode/stats")
+async def encode_stats():
+    return batcher.stats()
\ No newline at end of file
@@ -0,0 +1,19 @@
+from pathlib import Path
+from typing import Iterator
+from tests.faculty_site import Site, build_site, serve_site
+import pytest
+
+PAGES = 40
+
+@pytest.fixture
+def faculty_site(tmp_path: Path) -> Path:
+    return build_site(tmp_path / "site", PAGES)
+
+@pytest.fixture
+def site(faculty_site: Path) -> Iterator[Site]:
+    with serve_site(faculty_site) as site:
+        yield site
+
+@pytest.fixture
+def site_url(site: Site) -> str:
+    return site.url
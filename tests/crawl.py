@@ -0,0 +1,109 @@
+from pathlib import Path
+from typing import Any, Dict
+from urllib.parse import urljoin
+import subprocess
+import json
+import sys
+import os
+
+# runs one crawl of the faculty spider against a local site in a fresh process, since the twisted
+# reactor can't be restarted, and reports its items, stats and effective settings as json
+
+ROOT = Path(__file__).resolve().parent.parent
+
+class JsonPagePipeline:
+    # stands in for the mongo pipelines: keeps url -> page_version of the stored pages in a json
+    # file and hands them to the skip middlewares the same way
+
+    def open_spider(self, spider: Any) -> None:
+        from ecalendar.middlewares import PageVersions, skips_unchanged
+
+        self.path = Path(spider.settings["PAGE_STORE"])
+        self.versions = json.loads(self.path.read_text()) if self.path.exists() else {}
+        if skips_unchanged(spider.settings):
+            spider.page_versions = PageVersions(self.versions)
+
+    def process_item(self, item: Dict[str, Any], spider: Any) -> Dict[str, Any]:
+        url = urljoin(spider.settings["SITE_URL"], item["url"])
+        self.versions[url] = item.pop("page_version", None)
+        return item
+
+    def close_spider(self, spider: Any) -> None:
+        self.path.write_text(json.dumps(self.versions))
+
+def run_crawl(site: str, 
+              cache_dir: Path, 
+              settings: Dict[str, Any] | None = None, 
+              store: Path | None = None, # json file of the stored page versions, no pipeline without it
+              env: Dict[str, str | None] | None = None, # None unsets a variable
+              **spider_args: Any) -> Dict[str, Any]:
+    settings = dict(settings or {})
+    if store is not None:
+        settings.update({"ITEM_PIPELINES": {"tests.crawl.JsonPagePipeline": 300}, "PAGE_STORE": str(store)})
+    options = {"site": site, "cache_dir": str(cache_dir), "settings": settings, "spider_args": spider_args}
+    # no delay by default so the tests don't wait on politeness
+    environment = {**os.environ, "FACULTY_DOWNLOAD_DELAY": "0"}
+    for key, value in (env or {}).items():
+        if value is None:
+            environment.pop(key, None)
+        else:
+            environment[key] = value
+    result = subprocess.run(
+        [sys.executable, "-m", "tests.crawl", json.dumps(options)],
+        cwd=ROOT, env=environment, capture_output=True, text=True, timeout=300
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Crawl failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def crawl(site: str, cache_dir: str, settings: Dict[str, Any], spider_args: Dict[str, Any]) -> Dict[str, Any]:
+    from scrapy import signals
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.project import get_project_settings
+    from ecalendar.spiders.faculty import CSFacultySpider
+
+    class LocalFacultySpider(CSFacultySpider):
+        name = "local_faculty"
+
+        def start_requests(self):
+            for request in super().start_requests():
+                yield request.replace(url=request.url.replace(f"https://{self.base_url}", site))
+
+        async def start(self):
+            for request in self.start_requests():
+                yield request
+
+        def fetch_content(self, text, url):
+            self.crawler.stats.inc_value("test/fetch_content_calls", spider=self)
+            return super().fetch_content(text, url)
+
+    project_settings = get_project_settings()
+    project_settings.setdict({
+        "ITEM_PIPELINES": {},
+        "HTTPCACHE_DIR": cache_dir,
+        "SITE_URL": site,
+        "LOG_LEVEL": "ERROR",
+        "TELNETCONSOLE_ENABLED": False,
+        **settings,
+    }, priority="cmdline")
+
+    process = CrawlerProcess(project_settings)
+    crawler = process.create_crawler(LocalFacultySpider)
+    items = []
+
+    def item_scraped(item: Dict[str, Any], **kwargs: Any) -> None:
+        items.append(item)
+
+    crawler.signals.connect(item_scraped, signal=signals.item_scraped)
+    process.crawl(crawler, **spider_args)
+    process.start()
+
+    return {
+        "items": items,
+        "stats": {key: value for key, value in crawler.stats.get_stats().items() if isinstance(value, (int, float))},
+        "settings": {key: crawler.settings[key] for key in 
+                     ("DOWNLOAD_DELAY", "CONCURRENT_REQUESTS_PER_DOMAIN", "AUTOTHROTTLE_START_DELAY")},
+    }
+
+if __name__ == "__main__":
+    print(json.dumps(crawl(**json.loads(sys.argv[1]))))
@@ -0,0 +1,116 @@
+from collections import Counter
+from contextlib import contextmanager
+from functools import partial
+from http import HTTPStatus
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Iterator, NamedTuple
+import threading
+import hashlib
+import random
+import sys
+import io
+
+# a static stand-in for www.cs.mcgill.ca with the structure the faculty spider reads: a header
+# with the site navigation, panels of headed sections (some nested) and links between pages,
+# including links the spider excludes and links without a trailing slash.
+# `python -m tests.faculty_site <dir> [pages] [port]` builds and serves it for local crawls
+
+def page_html(index: int, pages: int, rng: random.Random) -> str:
+    links = {(index + 1) % pages, *rng.sample(range(pages), 4)}
+    # every other link has no trailing slash, the spider adds it
+    hrefs = "".join(f'<a href="/p{link}{"/" if link % 2 else ""}">page {link}</a>' for link in sorted(links))
+    sections = "".join(
+        f"<h2>Section {index}-{section}</h2>"
+        + "".join(f"<p>{' '.join(rng.choices(['course', 'research', 'faculty', 'program', 'student'], k=20))}</p>"
+                  for _ in range(rng.randint(1, 3)))
+        + (f"<div><h3>Details {index}-{section}</h3><p>nested {section}</p></div>" if section % 2 else "")
+        for section in range(rng.randint(1, 4))
+    )
+    return (
+        '<html><head><title>Page {0}</title></head><body>'
+        '<div id="headercontainer"><a href="/p0/">home</a><a href="/people/staff">people</a></div>'
+        '<div class="panel"><h1>Page {0}</h1>{1}</div>'
+        '<div class="panel">{2}<a href="/news/today">news</a><a href="https://example.com/">elsewhere</a></div>'
+        '</body></html>'
+    ).format(index, sections, hrefs)
+
+def build_site(root: Path, pages: int = 60, seed: int = 0) -> Path:
+    rng = random.Random(seed)
+    root.mkdir(parents=True, exist_ok=True)
+    (root / "index.html").write_text(
+        '<html><body><div id="headercontainer"><a href="/p0/">home</a></div>'
+        '<div class="panel"><h1>Home</h1><a href="/p0/">start</a></div></body></html>'
+    )
+    for index in range(pages):
+        page = root / f"p{index}"
+        page.mkdir(exist_ok=True)
+        (page / "index.html").write_text(page_html(index, pages, rng))
+    return root
+
+# answers like a server that revalidates: every page has an ETag of its content, is sent with
+# Cache-Control: no-cache and a request with a matching If-None-Match gets a 304 without a body
+class SiteHandler(SimpleHTTPRequestHandler):
+
+    def __init__(self, *args: Any, statuses: Counter, **kwargs: Any) -> None:
+        self.statuses = statuses
+        super().__init__(*args, **kwargs)
+
+    def send_head(self):
+        path = Path(self.translate_path(self.path))
+        if path.is_dir() and self.path.endswith("/"):
+            path = path / "index.html"
+        if not path.is_file():
+            return super().send_head()
+
+        body = path.read_bytes()
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return None
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", self.guess_type(str(path)))
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        return io.BytesIO(body)
+
+    def send_response(self, code: int, message: str | None = None) -> None:
+        self.statuses[int(code)] += 1
+        super().send_response(code, message)
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+class Site(NamedTuple):
+    url: str
+    # responses sent by status code
+    statuses: Counter
+
+@contextmanager
+def serve_site(root: Path, port: int = 0) -> Iterator[Site]:
+    # serves the site on a background thread
+    statuses: Counter = Counter()
+    server = ThreadingHTTPServer(("127.0.0.1", port), partial(SiteHandler, directory=str(root), statuses=statuses))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield Site(f"http://127.0.0.1:{server.server_address[1]}", statuses)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if not args:
+        print("Usage: python -m tests.faculty_site <dir> [pages] [port]")
+        sys.exit(1)
+
+    root = build_site(Path(args[0]), int(args[1]) if len(args) > 1 else 60)
+    with serve_site(root, int(args[2]) if len(args) > 2 else 8765) as site:
+        print(f"Serving {root} on {site.url}")
+        threading.Event().wait()
@@ -0,0 +1,64 @@
+from bs4 import BeautifulSoup, Tag
+from typing import Dict
+import random
+
+# the faculty panel segmentation as it was before segment_panel, which walked the siblings of
+# every header up to the next one. kept as the reference the one pass segmenter must match
+
+HEADERS = ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']
+
+def reference_fetch_content(soup: BeautifulSoup) -> Dict[str, str]:
+    content_dict: Dict[str, str] = {}
+    for panel in soup.find_all('div', class_='panel'):
+        if not isinstance(panel, Tag):
+            continue
+        for header in panel.find_all(HEADERS):
+            title = header.get_text().strip().strip().strip('\n')
+            content = []
+
+            current = header.next_sibling
+            while current and (not isinstance(current, Tag) or current.name not in HEADERS):
+                if str(current).strip():
+                    content.append(current.get_text().strip() if isinstance(current, Tag) else str(current).strip())
+                current = current.next_sibling
+
+            if title:
+                if content_dict.get(title):
+                    content_dict[title] += '\n' + '\n'.join(filter(None, content))
+                else:
+                    content_dict[title] = '\n'.join(filter(None, content))
+    return content_dict
+
+def random_fragment(rng: random.Random, depth: int = 0) -> str:
+    # headers (with repeated and blank titles), stray text, comments, scripts, empty tags and
+    # nested divs that put headers at different depths of the same panel
+    parts = []
+    for _ in range(rng.randint(1, 6)):
+        kind = rng.random()
+        if kind < 0.25:
+            level = rng.randint(1, 6)
+            parts.append(f"<h{level}>{rng.choice(['A', 'B', 'C', ' ', 'Same'])}</h{level}>")
+        elif kind < 0.35:
+            parts.append(rng.choice(["text ", " ", "\n", "<!-- c -->", "<br/>", "<script>var x</script>"]))
+        elif kind < 0.45:
+            parts.append("<p></p>")
+        elif depth < 4:
+            parts.append(f"<div>{random_fragment(rng, depth + 1)}</div>")
+        else:
+            parts.append(f"<p>p{rng.randint(0, 9)}</p>")
+    return "".join(parts)
+
+def random_page(seed: int) -> str:
+    rng = random.Random(seed)
+    panels = "".join(f'<div class="panel">{random_fragment(rng)}</div>' for _ in range(rng.randint(1, 3)))
+    return f"<html><body>{panels}</body></html>"
+
+def large_page(sections: int = 3000) -> str:
+    # one panel with many headed sections, each followed by a nested section
+    body = "".join(
+        f"<h2>T{i % 300}</h2>"
+        + "".join(f"<p>para {j} {'word ' * 30}</p>" for j in range(5))
+        + f"<div><h3>S{i}</h3><p>nested</p></div>"
+        for i in range(sections)
+    )
+    return f'<html><body><div class="panel">{body}</div></body></html>'
@@ -0,0 +1,64 @@
+from database import bulk_writer
+from database.bulk_writer import BulkWriteBuffer
+from pymongo import UpdateOne
+from pymongo.errors import AutoReconnect, BulkWriteError, OperationFailure
+from typing import List
+import pytest
+
+# a collection whose bulk_write answers with the scripted outcomes in order, None meaning success
+
+class FakeCollection:
+
+    def __init__(self, *outcomes: Exception | None) -> None:
+        self.outcomes = list(outcomes)
+        self.calls: List[List[UpdateOne]] = []
+
+    def bulk_write(self, operations: List[UpdateOne], ordered: bool = True) -> None:
+        assert not ordered
+        self.calls.append(list(operations))
+        if outcome := self.outcomes.pop(0):
+            raise outcome
+
+def write_errors(*errors: tuple[int, int]) -> BulkWriteError:
+    return BulkWriteError({"writeErrors": [{"index": index, "code": code} for index, code in errors]})
+
+def operations(count: int) -> List[UpdateOne]:
+    return [UpdateOne({"id": i}, {"$set": {"n": i}}) for i in range(count)]
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(bulk_writer.time, "sleep", lambda seconds: None)
+
+def test_only_transient_errors_are_retried() -> None:
+    ops = operations(5)
+    # 11000 duplicate key is permanent, 112 write conflict and 189 stepdown are transient
+    collection = FakeCollection(write_errors((1, 11000), (2, 112), (4, 189)), None)
+    writes = BulkWriteBuffer(collection)
+
+    assert writes.write(ops) == 1
+    assert collection.calls[1] == [ops[2], ops[4]]
+    assert (writes.flushes, writes.written, writes.retried, writes.failed) == (1, 4, 2, 1)
+
+def test_retries_stop_after_max_retries() -> None:
+    collection = FakeCollection(*[write_errors((0, 91))] * 3)
+    writes = BulkWriteBuffer(collection, max_retries=2)
+
+    assert writes.write(operations(3)) == 1
+    assert len(collection.calls) == 3
+    assert (writes.written, writes.retried, writes.failed) == (2, 2, 1)
+
+def test_reconnects_retry_the_whole_batch() -> None:
+    collection = FakeCollection(AutoReconnect("primary stepped down"), None)
+    writes = BulkWriteBuffer(collection)
+
+    assert writes.write(operations(3)) == 0
+    assert (writes.written, writes.retried, writes.failed) == (3, 3, 0)
+
+def test_other_errors_are_counted_and_raised() -> None:
+    collection = FakeCollection(write_errors((0, 112)), OperationFailure("unauthorized", code=13))
+    writes = BulkWriteBuffer(collection)
+
+    with pytest.raises(OperationFailure):
+        writes.write(operations(3))
+    # two operations were written by the first attempt, the retried one never made it
+    assert (writes.flushes, writes.written, writes.failed) == (1, 2, 1)
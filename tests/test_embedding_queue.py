@@ -0,0 +1,65 @@
+from database.embedding_queue import EmbeddingJob, EmbeddingQueue
+from pathlib import Path
+from typing import Iterator
+import pytest
+import time
+
+@pytest.fixture
+def queue(tmp_path: Path) -> Iterator[EmbeddingQueue]:
+    queue = EmbeddingQueue(str(tmp_path / "queue.sqlite3"), lease_seconds=60)
+    yield queue
+    queue.close()
+
+def job(doc_id: str, text: str) -> EmbeddingJob:
+    return EmbeddingJob("general", "id", doc_id, "embeddings", text)
+
+def test_leased_jobs_are_not_leased_again(queue: EmbeddingQueue) -> None:
+    queue.enqueue_many([job("a", "first"), job("b", "second"), job("c", "third")])
+
+    leased = queue.lease(2)
+    assert [(j.doc_id, j.text) for j in leased] == [("a", "first"), ("b", "second")]
+    assert [j.doc_id for j in queue.lease(10)] == ["c"]
+    assert queue.lease(10) == []
+
+    queue.ack(leased)
+    assert len(queue) == 1
+
+def test_expired_leases_are_leased_again(tmp_path: Path) -> None:
+    queue = EmbeddingQueue(str(tmp_path / "queue.sqlite3"), lease_seconds=0.05)
+    queue.enqueue_many([job("a", "first")])
+    first = queue.lease(10)
+
+    time.sleep(0.1)
+    # the worker holding the first lease died, its job comes back unchanged
+    assert queue.lease(10) == first
+    queue.close()
+
+def test_released_jobs_are_leased_again(queue: EmbeddingQueue) -> None:
+    queue.enqueue_many([job("a", "first")])
+    leased = queue.lease(10)
+
+    queue.release(leased)
+    assert queue.lease(10) == leased
+
+def test_enqueue_replaces_the_text_of_a_queued_document(queue: EmbeddingQueue) -> None:
+    queue.enqueue_many([job("a", "first")])
+    queue.enqueue_many([job("a", "second")])
+
+    assert len(queue) == 1
+    [leased] = queue.lease(10)
+    assert (leased.text, leased.version) == ("second", 1)
+
+def test_ack_keeps_a_job_whose_text_changed_while_leased(queue: EmbeddingQueue) -> None:
+    queue.enqueue_many([job("a", "first")])
+    stale = queue.lease(10)
+
+    # the page changed while a worker was encoding the old text
+    queue.enqueue_many([job("a", "second")])
+    queue.ack(stale)
+    assert len(queue) == 1
+
+    # the newer version is leasable right away and acked normally
+    current = queue.lease(10)
+    assert [j.text for j in current] == ["second"]
+    queue.ack(current)
+    assert len(queue) == 0
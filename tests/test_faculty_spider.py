@@ -0,0 +1,39 @@
+from pathlib import Path
+from tests.conftest import PAGES
+from tests.crawl import run_crawl
+
+def test_single_pass_downloads_every_page_once(site_url: str, tmp_path: Path) -> None:
+    result = run_crawl(site_url, tmp_path / "cache")
+
+    urls = [item["url"] for item in result["items"]]
+    assert sorted(urls) == sorted(f"/p{index}/" for index in range(PAGES))
+    # the home page, then each page once, excluded and external links are not followed
+    assert result["stats"]["downloader/request_count"] == PAGES + 1
+    assert all(item["content"] for item in result["items"])
+
+def test_two_pass_finds_the_same_content(site_url: str, tmp_path: Path) -> None:
+    single = run_crawl(site_url, tmp_path / "single")
+    # both passes of a page fetch the same url, the second one is revalidated by the http cache
+    two = run_crawl(site_url, tmp_path / "two", single_pass="0")
+
+    assert two["stats"]["downloader/request_count"] == 2 * PAGES + 1
+    by_url = {item["url"]: item["content"] for item in single["items"]}
+    assert {item["url"]: item["content"] for item in two["items"]} == by_url
+
+def test_politeness_settings_are_configurable(site_url: str, tmp_path: Path) -> None:
+    result = run_crawl(site_url, tmp_path / "cache", 
+                       env={"FACULTY_DOWNLOAD_DELAY": "0.01", "FACULTY_CONCURRENT_REQUESTS": "2"})
+
+    assert result["settings"] == {
+        "DOWNLOAD_DELAY": 0.01,
+        "CONCURRENT_REQUESTS_PER_DOMAIN": 2,
+        "AUTOTHROTTLE_START_DELAY": 0.01,
+    }
+    assert len(result["items"]) == PAGES
+
+def test_default_settings_keep_a_delay(site_url: str, tmp_path: Path) -> None:
+    result = run_crawl(site_url, tmp_path / "cache", {"CLOSESPIDER_PAGECOUNT": 2},
+                       env={"FACULTY_DOWNLOAD_DELAY": None})
+
+    assert result["settings"]["DOWNLOAD_DELAY"] > 0
+    assert result["settings"]["CONCURRENT_REQUESTS_PER_DOMAIN"] <= 4
@@ -0,0 +1,36 @@
+from bs4 import BeautifulSoup
+from ecalendar.spiders.faculty import CSFacultySpider
+from tests.segmentation import large_page, random_page, reference_fetch_content
+import pytest
+
+@pytest.fixture(scope="module")
+def spider() -> CSFacultySpider:
+    return CSFacultySpider()
+
+def test_matches_the_reference_on_random_panels(spider: CSFacultySpider) -> None:
+    mismatches = []
+    for seed in range(3000):
+        soup = BeautifulSoup(random_page(seed), "html.parser")
+        expected = reference_fetch_content(soup)
+        actual = spider.fetch_content(soup, f"seed {seed}")
+        # same sections, in the same order
+        if list(actual.items()) != list(expected.items()):
+            mismatches.append(seed)
+    assert not mismatches, f"{len(mismatches)} pages differ, first seeds: {mismatches[:10]}"
+
+def test_matches_the_reference_on_a_large_page(spider: CSFacultySpider) -> None:
+    soup = BeautifulSoup(large_page(300), "html.parser")
+    assert list(spider.fetch_content(soup, "large").items()) == list(reference_fetch_content(soup).items())
+
+@pytest.mark.parametrize("html, expected", [
+    # text before the first header belongs to no section
+    ('<div class="panel">intro<h2>A</h2><p>a</p><h2>B</h2>b</div>', {"A": "a", "B": "b"}),
+    # a repeated title collects the text of both sections
+    ('<div class="panel"><h2>A</h2><p>1</p><h3>A</h3><p>2</p></div>', {"A": "1\n2"}),
+    # a nested header ends at the end of its parent
+    ('<div class="panel"><h2>A</h2><div><h3>B</h3><p>b</p></div><p>a</p></div>', 
+     {"A": "Bb\na", "B": "b"}),
+    ('<div class="panel"><p>no headers</p></div>', {}),
+])
+def test_sections(spider: CSFacultySpider, html: str, expected: dict) -> None:
+    assert spider.fetch_content(f"<html><body>{html}</body></html>", "case") == expected
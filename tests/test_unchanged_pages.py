@@ -0,0 +1,72 @@
+from pathlib import Path
+from tests.conftest import PAGES
+from tests.crawl import run_crawl
+from tests.faculty_site import Site
+import json
+
+# recrawls of the stand-in site, which answers revalidations with 304s. a page is only skipped
+# when the pipeline stored its items with the same page version
+
+def recrawl(site: Site, tmp_path: Path, store: Path | None) -> dict:
+    site.statuses.clear()
+    return run_crawl(site.url, tmp_path / "cache", store=store)
+
+def test_recrawl_skips_stored_pages(site: Site, tmp_path: Path) -> None:
+    store = tmp_path / "store.json"
+    first = run_crawl(site.url, tmp_path / "cache", store=store)
+    assert len(first["items"]) == PAGES
+    assert first["stats"]["test/fetch_content_calls"] == PAGES
+    assert len(json.loads(store.read_text())) == PAGES
+
+    second = recrawl(site, tmp_path, store)
+    # every page is revalidated, none is downloaded again
+    assert site.statuses == {304: PAGES + 1}
+    assert second["items"] == []
+    # single pass pages only have their links followed, their content is not segmented
+    assert second["stats"]["unchanged_pages/skipped"] == PAGES
+    assert "unchanged_pages/items_dropped" not in second["stats"]
+    assert "test/fetch_content_calls" not in second["stats"]
+
+def test_pages_that_were_not_stored_are_parsed_again(site: Site, tmp_path: Path) -> None:
+    store = tmp_path / "store.json"
+    run_crawl(site.url, tmp_path / "cache", store=store)
+
+    # the cache has every page but some never made it to the store, e.g. the crawl crashed
+    versions = json.loads(store.read_text())
+    lost = sorted(versions)[:5]
+    store.write_text(json.dumps({url: version for url, version in versions.items() if url not in lost}))
+
+    second = recrawl(site, tmp_path, store)
+    assert site.statuses == {304: PAGES + 1}
+    assert sorted(site.url + item["url"] for item in second["items"]) == lost
+
+def test_nothing_is_skipped_without_stored_pages(site: Site, tmp_path: Path) -> None:
+    # a crawl without a pipeline caches the pages but stores nothing
+    run_crawl(site.url, tmp_path / "cache")
+
+    second = recrawl(site, tmp_path, tmp_path / "store.json")
+    assert site.statuses == {304: PAGES + 1}
+    assert len(second["items"]) == PAGES
+
+def test_changed_page_is_parsed(site: Site, faculty_site: Path, tmp_path: Path) -> None:
+    store = tmp_path / "store.json"
+    run_crawl(site.url, tmp_path / "cache", store=store)
+
+    page = faculty_site / "p7" / "index.html"
+    page.write_text(page.read_text().replace("<h1>Page 7</h1>", "<h1>Page 7</h1><h2>New</h2><p>added</p>"))
+
+    second = recrawl(site, tmp_path, store)
+    assert site.statuses == {200: 1, 304: PAGES}
+    assert [item["url"] for item in second["items"]] == ["/p7/"]
+    assert second["items"][0]["content"]["New"] == "added"
+
+def test_two_pass_recrawl_skips_stored_pages_before_parsing(site: Site, tmp_path: Path) -> None:
+    store = tmp_path / "store.json"
+    first = run_crawl(site.url, tmp_path / "cache", store=store, single_pass="0")
+    assert len(first["items"]) == PAGES
+
+    site.statuses.clear()
+    second = run_crawl(site.url, tmp_path / "cache", store=store, single_pass="0")
+    assert second["items"] == []
+    # the content requests are dropped before parsing, the discovery ones still follow links
+    assert second["stats"]["unchanged_pages/skipped"] == PAGES